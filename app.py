@@ -1,21 +1,60 @@
 # app.py
 
 # 1. IMPORTAÇÕES
-import pandas as pd
-import io
-import sqlite3
-import json
 import os
-# Linha alterada: Adicionado timedelta para cálculos de fuso horário
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory, send_file
-from collections import defaultdict
+import json
+import click
+from datetime import datetime
+from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory, send_file, Response
+# Camada única de acesso ao SQLite (pool de conexões + WAL)
+import db
+# Eventos do ciclo de vida dos pedidos (Server-Sent Events)
+import events
+from migrations import run_migrations, add_epoch_ms_columns
+# Conferência e baixa de estoque do carrinho inteiro
+import inventory
+# Cache do cardápio público (/api/stock)
+from menu_cache import menu
+# Totais de vendas mantidos a cada pedido
+import sales
+# Exportação das vendas em blocos (CSV/XLSX)
+import sales_export
+# Gravação de pedidos (direta ou pela fila com group commit)
+from orders import place_order, created_response, StockUnavailable
+import ingest
+# Reenvios do mesmo pedido (cabeçalho Idempotency-Key)
+import idempotency
+# Métricas de latência por rota e por comando SQL (/metrics)
+import metrics
+# Versões reduzidas das fotos do estoque (WebP/JPEG com nome por hash)
+import images
+# Arquivamento dos pedidos antigos (orders_archive)
+import archive
+# Respostas JSON das telas: serializadas uma vez por versão e comprimidas
+import responses
+# Quadro de pedidos em memória (cozinha, monitor, painel de status e gerente)
+from board import board
+# Mudanças de estoque/pedidos avisadas a todos os processos (change_log)
+import changes
+# Importação/alteração do estoque em lote (JSON ou planilha)
+import stock_bulk
+# Exportação/análise de vendas em segundo plano (pool de processos)
+import jobs
+# Conexões somente leitura (cópia do banco) para os relatórios do admin
+import reporting
+# Datas em milissegundos (UTC) e agrupamento por dia/hora no horário de Brasília
+import timeutil
 
 # 2. CONFIGURAÇÃO INICIAL DO FLASK
 app = Flask(__name__)
 UPLOAD_FOLDER = 'uploads'
 STATIC_FOLDER = 'static' # Adicionado para clareza
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Tamanho máximo de um upload (MB)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+
+# Mede cada requisição e cada comando SQL (desligue com METRICS_ENABLED=0)
+metrics.init_app(app, db)
 
 # Garante que as pastas de uploads e static existam
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -23,7 +62,7 @@ os.makedirs(STATIC_FOLDER, exist_ok=True) # Garante que a pasta static exista
 
 # 3. FUNÇÃO DE INICIALIZAÇÃO DO BANCO DE DADOS
 def init_db():
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     # Tabela de Pedidos (com o novo campo 'status')
     cursor.execute('''
@@ -38,7 +77,9 @@ def init_db():
             payment_method TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             called_at TIMESTAMP,
-            status TEXT NOT NULL DEFAULT 'preparing' -- Status: preparing, ready, completed
+            status TEXT NOT NULL DEFAULT 'preparing', -- Status: preparing, ready, completed
+            created_at_ms INTEGER, -- created_at em ms desde 1970 (UTC), ver timeutil.py
+            called_at_ms INTEGER   -- called_at em ms desde 1970 (UTC)
         )
     ''')
     # Tabela de Estoque
@@ -52,7 +93,8 @@ def init_db():
             quantity INTEGER NOT NULL,
             detailed_description TEXT,
             is_available INTEGER NOT NULL DEFAULT 1, -- 1 for True, 0 for False
-            is_promo INTEGER NOT NULL DEFAULT 0 -- 0 for False, 1 for True (Brinde)
+            is_promo INTEGER NOT NULL DEFAULT 0, -- 0 for False, 1 for True (Brinde)
+            image_variants TEXT -- JSON com as URLs das versões reduzidas da foto
         )
     ''')
     # Tabela de Avaliações
@@ -61,16 +103,142 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             customer_name TEXT,
             score TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at_ms INTEGER -- ms desde 1970 (UTC)
+        )
+    ''')
+    # Bancos antigos: cria e preenche as colunas em ms antes dos índices e das migrações
+    add_epoch_ms_columns(cursor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scores_created_ms ON scores(created_at_ms)")
+    # Contador das senhas dos pedidos (evita varrer orders para achar a última senha)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_sequence (
+            name TEXT PRIMARY KEY,
+            last_value INTEGER NOT NULL DEFAULT 0,
+            period TEXT NOT NULL DEFAULT '' -- Dia da última senha (usado no reinício diário)
         )
     ''')
+    # Itens de cada pedido (substitui as listas JSON de orders.item_names/quantities
+    # para consultas; as colunas antigas continuam sendo gravadas para compatibilidade)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+            stock_id INTEGER REFERENCES stock(id) ON DELETE SET NULL,
+            name_snapshot TEXT NOT NULL, -- Nome exibido ao cliente no momento da compra
+            quantity INTEGER NOT NULL,
+            unit_price REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_stock ON order_items(stock_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items(name_snapshot, quantity)")
+    # Agregados de vendas (por item, por dia e por hora)
+    for create_table in sales.CREATE_TABLES:
+        cursor.execute(create_table)
+    # Pedidos antigos arquivados
+    archive.create_tables(cursor)
+    # Mudanças avisadas aos outros processos (barramento de mudanças)
+    changes.bus.backend.create_tables(cursor)
+    # Respostas já enviadas para cada Idempotency-Key do checkout
+    cursor.execute(idempotency.CREATE_TABLE)
+    cursor.execute(idempotency.CREATE_INDEX)
+    # Índices das consultas por status usadas pelas telas (cozinha, monitor, gerente)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)")
+    # Últimas senhas chamadas (monitor) e corte do arquivamento
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_called_ms ON orders(status, called_at_ms)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created_ms ON orders(status, created_at_ms)")
+    # Índices dos filtros da lista de vendas (por período, pagamento e cliente)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_ms ON orders(created_at_ms)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_payment_created_ms ON orders(payment_method, created_at_ms)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_name COLLATE NOCASE)")
+    # Índice parcial só com os pedidos "vivos" (fica pequeno mesmo com muito histórico).
+    # Mesmo filtro e ordem da carga do quadro de pedidos (board.py): lê sem ordenar.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_board ON orders(created_at) WHERE status IN ('pending_payment', 'preparing', 'ready')")
+    conn.commit()
+    # Converte dados de bancos antigos (roda só uma vez por banco)
+    run_migrations(conn)
+    # Visão única dos pedidos vivos e arquivados (lista de vendas, exportação)
+    archive.create_view(cursor)
     conn.commit()
-    conn.close()
+    # Atualiza as estatísticas usadas pelo planejador de consultas, se necessário
+    cursor.execute("PRAGMA optimize")
+    check_query_plans(conn)
+    db.release_connection(conn)
+
+# Consultas executadas a cada atualização das telas: nenhuma pode varrer a
+# tabela inteira nem ordenar em tabela temporária
+HOT_QUERIES = [
+    ("board_load", '''
+        SELECT o.id, o.order_number, o.customer_name, o.status, o.created_at, oi.name_snapshot, oi.quantity
+        FROM orders o INDEXED BY idx_orders_board LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.status IN ('pending_payment', 'preparing', 'ready') ORDER BY o.created_at ASC, o.id ASC, oi.id ASC
+    ''', ()),
+    ("kitchen_orders", '''
+        SELECT o.id, o.order_number, o.customer_name, oi.name_snapshot, oi.quantity
+        FROM orders o LEFT JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.status = 'preparing' ORDER BY o.created_at ASC, o.id ASC, oi.id ASC
+    ''', ()),
+    ("monitor_called", "SELECT order_number, customer_name FROM orders WHERE status = 'completed' ORDER BY called_at_ms DESC LIMIT 6", ()),
+    ("next_order", "SELECT id, customer_name, order_number FROM orders WHERE status = 'ready' ORDER BY created_at ASC LIMIT 1", ()),
+    ("ready_count", "SELECT COUNT(id) FROM orders WHERE status = 'ready'", ()),
+    ("pending_payments", "SELECT id, order_number, customer_name, total, created_at FROM orders WHERE status = 'pending_payment' ORDER BY created_at DESC", ()),
+    ("check_status", "SELECT status FROM orders WHERE id = ?", (0,)),
+    ("order_items_restock", "SELECT stock_id, quantity FROM order_items WHERE order_id = ?", (0,)),
+]
+
+def check_query_plans(conn):
+    """Avisa no terminal se alguma consulta quente fizer varredura completa ou ordenação temporária."""
+    try:
+        problems = db.find_full_scans(conn, HOT_QUERIES)
+    except Exception as e:
+        print(f"Erro ao verificar planos de consulta: {e}")
+        return
+    for name, detail in problems:
+        print(f"AVISO: consulta '{name}' sem índice adequado: {detail}")
+
+# Eventos de pedidos que mudam as quantidades do estoque
+_STOCK_AFFECTING_EVENTS = ('order_created', 'payment_rejected')
+
+def apply_change(change):
+    """
+    Aplica uma mudança do barramento neste processo. As mudanças feitas aqui
+    mesmo já atualizaram o cardápio e o quadro na própria rota; as de outros
+    processos invalidam os caches. Todas viram eventos SSE com a versão global.
+    """
+    remote = change['origin'] != changes.bus.origin
+    if change['topic'] == 'stock':
+        if remote:
+            if change['event'] == 'quantities_changed':
+                menu.quantities_changed()
+            else:
+                menu.invalidate()
+        # Não vira evento SSE, mas a versão conta (os ids dos eventos seguem sem buraco)
+        events.broker.skip(change['version'])
+        return
+    if remote:
+        board.invalidate()
+        if change['event'] in _STOCK_AFFECTING_EVENTS:
+            menu.quantities_changed()
+    events.publish(change['event'], event_id=change['version'], **change['data'])
+
+changes.bus.subscribe(apply_change)
+# Os ids dos eventos SSE começam na versão global lida quando a thread do barramento inicia
+changes.bus.on_start(events.broker.advance_to)
 
 # 4. ROTAS DAS PÁGINAS PRINCIPAIS (HTML)
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if images.is_hashed_name(filename):
+        # O nome vem do hash do conteúdo: o arquivo nunca muda, pode ficar em cache por 1 ano
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=31536000)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # Uploads antigos (nome original) podem ser sobrescritos: o navegador revalida com ETag
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=0)
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/')
 def index():
@@ -93,36 +261,6 @@ def kitchen():
     return render_template('kitchen.html')
 
 # 5. ROTAS DA API (JSON)
-def generate_order_number():
-    """
-    Busca o último número de pedido no banco de dados e gera o próximo.
-    Ex: Se o último for '005', retorna '006'. Se não houver, retorna '001'.
-    """
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    try:
-        # Busca o último pedido ordenando pela data de criação
-        cursor.execute("SELECT order_number FROM orders ORDER BY created_at DESC LIMIT 1")
-        last_order = cursor.fetchone()
-        
-        if last_order and last_order[0]:
-            # Se houver um último pedido, converte para inteiro, incrementa
-            last_num = int(last_order[0])
-            new_num = last_num + 1
-        else:
-            # Se for o primeiro pedido do dia (ou do banco)
-            new_num = 1
-            
-        # Retorna o número formatado com 3 dígitos (ex: 001, 010, 123)
-        return str(new_num).zfill(3)
-        
-    except Exception as e:
-        print(f"Erro ao gerar número do pedido: {e}")
-        # Fallback de emergência (não deve acontecer)
-        return "1"
-    finally:
-        conn.close()
-
 # --- API para Clientes e Pedidos ---
 @app.route('/api/orders', methods=['POST'])
 def add_order():
@@ -140,150 +278,125 @@ def add_order():
     if not customer_name or not items or total is None or not payment_method:
         return jsonify({"error": "Dados do pedido incompletos."}), 400
 
-    conn = None # Inicia conn como None
     try:
-        # --- INÍCIO DAS LINHAS MOVIDAS ---
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
-        
-        # Prepara os dados para o banco
-        item_names = json.dumps([item['name'] for item in items])
-        quantities = json.dumps([item['quantity'] for item in items])
-
-        # Gera o número do pedido (AGORA DENTRO DO TRY)
-        order_number = generate_order_number()
-
-        initial_status = 'pending_payment' if payment_method == 'pix' else 'preparing'
-        # --- FIM DAS LINHAS MOVIDAS ---
-        
-        # 2. Insere o Pedido
-        cursor.execute('''
-            INSERT INTO orders (customer_name, phone, item_names, quantities, total, order_number, payment_method, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (customer_name, phone, item_names, quantities, total, order_number, payment_method, initial_status))
+        cart = inventory.aggregate_cart(items)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Itens do pedido inválidos. Detalhe: {e}"}), 400
 
-        new_order_id = cursor.lastrowid
-        
-        # 3. Atualiza o Estoque
-        for item in items:
-            item_id = item['id']
-            item_quantity = item['quantity']
-            
-            # Subtrai a quantidade vendida do estoque
-            cursor.execute("UPDATE stock SET quantity = quantity - ? WHERE id = ?", (item_quantity, item_id))
-            
-            # Verificação de segurança (opcional, mas bom)
-            if cursor.rowcount == 0:
-                conn.rollback()
-                return jsonify({"error": f"Item ID {item_id} não encontrado no estoque durante a finalização do pedido."}), 404
+    # Se o cliente reenviar o pedido com a mesma chave, devolve a resposta original
+    idempotency_key = request.headers.get('Idempotency-Key')
+    request_hash = None
+    if idempotency_key:
+        if len(idempotency_key) > idempotency.MAX_KEY_LENGTH:
+            return jsonify({"error": "Idempotency-Key muito longa."}), 400
+        request_hash = idempotency.request_hash(data)
+        replay = _idempotent_replay(idempotency_key, request_hash)
+        if replay:
+            return replay
 
-        conn.commit()
-        return jsonify({
-            "message": "Pedido salvo com sucesso!", 
-            "order_number": order_number,
-            "order_id": new_order_id 
-        }), 201
+    order = {
+        "customer_name": customer_name,
+        "phone": phone,
+        "items": items,
+        "total": total,
+        "payment_method": payment_method,
+        "cart": cart,
+        "idempotency_key": idempotency_key,
+        "request_hash": request_hash,
+    }
 
+    try:
+        if ingest.GROUP_COMMIT_ENABLED:
+            # Horário de pico: o pedido entra na fila e é gravado junto com os
+            # outros que chegarem nos próximos milissegundos (um só commit)
+            future = ingest.writer.submit(order)
+            try:
+                result = future.result(timeout=ingest.SUBMIT_TIMEOUT_SECONDS)
+            except TimeoutError:
+                if future.cancel():
+                    # Ainda estava na fila: foi retirado e nunca será gravado
+                    return jsonify({"error": "Fila de pedidos ocupada. O pedido não foi registrado; tente novamente."}), 503
+                # Já está sendo gravado: o resultado pode ser consultado reenviando com a mesma Idempotency-Key
+                return jsonify({"status": "processing", "idempotency_key": idempotency_key,
+                                "message": "O pedido ainda está sendo registrado."}), 202
+        else:
+            result = _place_order_now(order)
+    except StockUnavailable as e:
+        return jsonify({"success": False, "message": "Estoque insuficiente.", "unavailable_items": e.unavailable_items}), 409
+    except idempotency.KeyInUse:
+        # Outra requisição com a mesma chave gravou o pedido primeiro
+        return _idempotent_replay(idempotency_key, request_hash) or (jsonify({"error": "Pedido com esta Idempotency-Key já está sendo processado."}), 409)
     except Exception as e:
-        if conn: # Só executa o rollback se a conexão foi estabelecida
-            conn.rollback()
         print(f"Erro ao finalizar pedido e atualizar estoque: {e}")
         return jsonify({"error": f"Erro interno ao finalizar pedido. Detalhe: {e}"}), 500
+
+    menu.quantities_changed()
+    board.add(result['order_id'], result['order_number'], result['customer_name'], result['status'],
+              result['created_at'], [(item['name'], item['quantity']) for item in items])
+    changes.bus.wake()
+    return jsonify(created_response(result)), 201
+
+def _idempotent_replay(key, request_hash):
+    """
+    Resposta original guardada para a chave, ou None se ela ainda não foi usada.
+    Se a chave foi usada com outro corpo de requisição, responde 422.
+    """
+    conn = db.get_connection()
+    try:
+        stored = idempotency.lookup(conn.cursor(), key)
     finally:
-        if conn: # Só fecha a conexão se ela foi estabelecida
-            conn.close()
+        db.release_connection(conn)
+    if stored is None:
+        return None
+    status_code, body, stored_hash = stored
+    if stored_hash != request_hash:
+        return jsonify({"error": "Idempotency-Key já usada com outro pedido. Gere uma nova chave para este pedido."}), 422
+    response = jsonify(body)
+    response.status_code = status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
 
-@app.route('/api/orders/status', methods=['GET'])
-def get_orders_by_status():
-    conn = sqlite3.connect('database.db')
+def _place_order_now(order):
+    """Grava um único pedido na sua própria transação."""
+    conn = db.get_connection()
     cursor = conn.cursor()
-    
     try:
-        # Busca pedidos em 'preparing' e 'ready'
-        cursor.execute("SELECT order_number, customer_name, item_names, quantities, status FROM orders WHERE status IN ('preparing', 'ready') ORDER BY created_at ASC")
-        orders_data = cursor.fetchall()
-        
-        preparing_orders = []
-        ready_orders = []
-
-        for row in orders_data:
-            order_number, name, item_names_str, quantities_str, status = row
-            
-            # --- CORREÇÃO APLICADA AQUI: USAR json.loads de forma segura ---
-            try:
-                # O item_names e quantities devem ser lidos como JSON, pois foram salvos assim.
-                item_names = json.loads(item_names_str)
-                quantities = json.loads(quantities_str)
-            except json.JSONDecodeError as e:
-                # Se falhar a leitura do JSON, registra o erro e pula este pedido.
-                print(f"Erro ao decodificar JSON do pedido #{order_number}: {e}")
-                continue # Pula para o próximo pedido.
-            # --- FIM DA CORREÇÃO ---
-
-            items_list = []
-            for i in range(len(item_names)):
-                items_list.append(f"{quantities[i]}x {item_names[i]}")
-            
-            order = {
-                "order_number": order_number,
-                "customer_name": name,
-                "items": items_list,
-                "status": status
-            }
-
-            if status == 'preparing':
-                preparing_orders.append(order)
-            elif status == 'ready':
-                ready_orders.append(order)
-
-        return jsonify({"preparing": preparing_orders, "ready": ready_orders}), 200
+        # Trava a escrita já no início: conferência e baixa do estoque, senha e
+        # INSERT acontecem na mesma transação, sem risco de vender o mesmo item duas vezes
+        cursor.execute("BEGIN IMMEDIATE")
+        result = place_order(cursor, order)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_connection(conn)
 
+@app.route('/api/orders/status', methods=['GET'])
+def get_orders_by_status():
+    try:
+        # O corpo só é remontado quando algum pedido muda (novo evento publicado)
+        entry = responses.screens.get('orders_status', events.broker.last_id, board.status_view)
+        return responses.send(entry)
     except Exception as e:
         print(f"Erro ao buscar pedidos por status: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/stock', methods=['GET'])
 def get_public_stock():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
     try:
-        # ALTERADO: Seleciona a nova coluna 'is_promo'
-        cursor.execute("SELECT id, name, quantity, price, image_path, detailed_description, is_promo FROM stock WHERE is_available = 1")
-        stock = cursor.fetchall()
-        
-        # ALTERADO: Lógica para modificar itens promocionais
-        stock_list = []
-        for item in stock:
-            item_id, name, qty, price, img, desc, is_promo = item
-            
-            if is_promo == 1:
-                # Se for brinde, muda o nome, preço e descrição para o cliente
-                stock_list.append({
-                    'id': item_id,
-                    'name': 'Item Promocional',
-                    'quantity': qty,
-                    'price': 0.0,
-                    'image_path': img,
-                    'detailed_description': 'Um brinde especial da casa para você!'
-                })
-            else:
-                # Item normal
-                stock_list.append({
-                    'id': item_id,
-                    'name': name,
-                    'quantity': qty,
-                    'price': price,
-                    'image_path': img,
-                    'detailed_description': desc
-                })
-                
-        return jsonify(stock_list), 200
+        # O cardápio vem pronto do cache (com os brindes já mascarados) e só é
+        # remontado quando o estoque muda
+        body, etag = menu.get()
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        # O navegador pode guardar, mas deve confirmar com o servidor (If-None-Match) antes de usar
+        response.headers['Cache-Control'] = 'no-cache'
+        # Responde 304 Not Modified se o cliente já tiver esta versão
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/stock/check', methods=['POST'])
 def check_stock():
@@ -292,36 +405,17 @@ def check_stock():
     if not items_in_cart:
         return jsonify({"error": "O carrinho está vazio."}), 400
     
-    conn = sqlite3.connect('database.db')
+    try:
+        cart = inventory.aggregate_cart(items_in_cart)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Itens do carrinho inválidos. Detalhe: {e}"}), 400
+
+    conn = db.get_connection()
     cursor = conn.cursor()
-    unavailable_items = []
     
     try:
-        for item in items_in_cart:
-            cursor.execute("SELECT name, quantity FROM stock WHERE id = ?", (item['id'],))
-            stock_item = cursor.fetchone() # Ex: ('Torta', 10) ou None
-
-            # --- INÍCIO DA CORREÇÃO ---
-            
-            # 1. Verifica se o item NÃO FOI ENCONTRADO no banco de dados
-            if not stock_item:
-                unavailable_items.append({
-                    "id": item['id'],
-                    # Pega o nome do carrinho, já que ele não existe mais no BD
-                    "name": item.get('name', 'Item removido'), 
-                    "requested": item['quantity'],
-                    "available": 0
-                })
-            # 2. Verifica se FOI ENCONTRADO, mas não tem estoque suficiente
-            elif stock_item[1] < item['quantity']:
-                unavailable_items.append({
-                    "id": item['id'],
-                    "name": stock_item[0], # Usa o nome do BD
-                    "requested": item['quantity'],
-                    "available": stock_item[1] # Informa o estoque real
-                })
-            
-            # --- FIM DA CORREÇÃO ---
+        # Confere o carrinho inteiro com uma única consulta
+        unavailable_items = inventory.find_unavailable(cursor, cart)
 
         if unavailable_items:
             return jsonify({"success": False, "message": "Estoque insuficiente.", "unavailable_items": unavailable_items}), 409
@@ -333,27 +427,28 @@ def check_stock():
         print(f"Erro inesperado em check_stock: {e}") 
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/score', methods=['POST'])
 def save_score():
     data = request.get_json()
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     
-    # NOVO: Define o horário de Brasília (UTC-3)
-    created_time_brt = datetime.utcnow() - timedelta(hours=3)
+    # O mesmo instante em ms (UTC) e no texto com o horário de Brasília (formato antigo)
+    created_ms = timeutil.now_ms()
+    created_time_brt = timeutil.local_now(created_ms)
     
     try:
         # ALTERADO: Adicionado 'created_at' na inserção com o horário de Brasília
-        cursor.execute("INSERT INTO scores (customer_name, score, created_at) VALUES (?, ?, ?)", (data.get('customer_name', 'Anônimo'), data['score'], created_time_brt))
+        cursor.execute("INSERT INTO scores (customer_name, score, created_at, created_at_ms) VALUES (?, ?, ?, ?)", (data.get('customer_name', 'Anônimo'), data['score'], created_time_brt, created_ms))
         conn.commit()
         return jsonify({"message": "Score salvo!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 # --- API para Administrador ---
 @app.route('/api/admin/login', methods=['POST'])
@@ -366,36 +461,63 @@ def admin_login():
 
 @app.route('/api/admin/sales', methods=['GET'])
 def get_sales():
-    conn = sqlite3.connect('database.db')
+    args = request.args
+    columns = ['id', 'Cliente', 'Itens', 'Quantidade', 'Total', 'Senha', 'Data/Hora']
+
+    # Sem parâmetros: lista completa (formato antigo, mantido para compatibilidade)
+    paginated = any(key in args for key in ('limit', 'cursor', 'status', 'payment_method', 'customer', 'from', 'to'))
+
+    # Lê a cópia dos relatórios, não o banco em que o checkout grava
+    conn = reporting.get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, customer_name, item_names, quantities, total, order_number, created_at FROM orders ORDER BY created_at DESC")
-        sales = cursor.fetchall()
-        columns = ['id', 'Cliente', 'Itens', 'Quantidade', 'Total', 'Senha', 'Data/Hora']
-        sales_list = [dict(zip(columns, sale)) for sale in sales]
-        return jsonify(sales_list), 200
+        data_as_of = reporting.as_of(conn)
+        if not paginated:
+            cursor.execute("SELECT id, customer_name, item_names, quantities, total, order_number, created_at FROM orders_all ORDER BY created_at_ms DESC")
+            sales_list = [dict(zip(columns, sale)) for sale in cursor.fetchall()]
+            return reporting.stamp(jsonify(sales_list), data_as_of), 200
+
+        # Paginação por cursor: ?limit=50&cursor=<next_cursor da página anterior>
+        # Filtros: ?status=a,b&payment_method=pix&customer=<início do nome>&from=AAAA-MM-DD&to=AAAA-MM-DD
+        try:
+            limit = max(1, min(int(args.get('limit', 50)), 500))
+            statuses = [s for s in args.get('status', '').split(',') if s]
+            where, params = sales.order_filters(args.get('from'), args.get('to'), statuses,
+                                                args.get('payment_method'), args.get('customer'))
+            rows, next_cursor = sales.list_page(cursor, where, params, args.get('cursor'), limit)
+        except ValueError as e:
+            return jsonify({"error": f"Parâmetros inválidos. Detalhe: {e}"}), 400
+
+        page_columns = columns + ['Status', 'Pagamento']
+        response = {"items": [dict(zip(page_columns, sale)) for sale in rows], "next_cursor": next_cursor,
+                    "data_as_of": data_as_of}
+        # O resumo (contagem e faturamento do filtro inteiro) só vem na primeira página
+        if not args.get('cursor') and args.get('summary', '1') != '0':
+            response["summary"] = sales.summary(cursor, where, params)
+        return reporting.stamp(jsonify(response), data_as_of), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        reporting.release_connection(conn)
 
 @app.route('/api/admin/stock', methods=['GET'])
 def get_stock():
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         # ALTERADO: Seleciona a nova coluna 'is_promo' (agora 8 colunas)
-        cursor.execute("SELECT id, name, quantity, price, image_path, detailed_description, is_available, is_promo FROM stock")
+        cursor.execute("SELECT id, name, quantity, price, image_path, detailed_description, is_available, is_promo, image_variants FROM stock")
         stock = cursor.fetchall()
         
         # ALTERADO: Adiciona 'is_promo' (índice 7) ao dicionário
-        stock_list = [{'id': i[0], 'name': i[1], 'quantity': i[2], 'price': i[3], 'image_path': i[4], 'detailed_description': i[5], 'is_available': i[6], 'is_promo': i[7]} for i in stock]
+        stock_list = [{'id': i[0], 'name': i[1], 'quantity': i[2], 'price': i[3], 'image_path': i[4], 'detailed_description': i[5], 'is_available': i[6], 'is_promo': i[7],
+                       'image_variants': json.loads(i[8]) if i[8] else None} for i in stock]
         
         return jsonify(stock_list), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/admin/stock/add', methods=['POST'])
 def add_new_stock():
@@ -421,228 +543,451 @@ def add_new_stock():
     
     # --- FIM DA CORREÇÃO ---
 
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
-    image_url = url_for('uploaded_file', filename=file.filename, _external=False)
+    # Grava o original e as versões reduzidas, com nomes pelo hash do conteúdo
+    try:
+        image_url, image_variants = images.process_upload(
+            file.read(), file.filename, app.config['UPLOAD_FOLDER'],
+            lambda name: url_for('uploaded_file', filename=name, _external=False))
+    except images.InvalidImage as e:
+        return jsonify({"error": str(e)}), 400
     
     # Esta lógica de 'price_val' e 'is_promo_val' já estava correta e é mantida.
     is_promo_val = 1 if is_promo else 0
     price_val = 0.0 if is_promo_val == 1 else float(data['price'])
     
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "INSERT INTO stock (name, quantity, price, image_path, detailed_description, is_promo) VALUES (?, ?, ?, ?, ?, ?)",
-            (data['name'], int(data['quantity']), price_val, image_url, data['detailed_description'], is_promo_val)
+            "INSERT INTO stock (name, quantity, price, image_path, detailed_description, is_promo, image_variants) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (data['name'], int(data['quantity']), price_val, image_url, data['detailed_description'], is_promo_val,
+             json.dumps(image_variants) if image_variants else None)
         )
+        changes.bus.record(cursor, 'stock', 'menu_changed')
         conn.commit()
+        menu.invalidate()
+        changes.bus.wake()
         return jsonify({"message": "Item adicionado com sucesso!"}), 201
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/admin/stock/replenish', methods=['POST'])
 def replenish_stock():
     data = request.json
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("UPDATE stock SET quantity = quantity + ? WHERE id = ?", (data['quantity'], data['id']))
-        conn.commit()
         if cursor.rowcount == 0: return jsonify({"message": "Item não encontrado."}), 404
+        changes.bus.record(cursor, 'stock', 'quantities_changed')
+        conn.commit()
+        menu.quantities_changed()
+        changes.bus.wake()
         return jsonify({"message": "Estoque atualizado!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
+
+@app.route('/api/admin/stock/bulk', methods=['POST'])
+def bulk_stock():
+    """
+    Altera/cria vários itens do estoque de uma vez: lista JSON (ou {"items": [...]})
+    ou planilha CSV/XLSX no campo 'file'. Com dry_run=1 só devolve o diff.
+    Com atomic=1 (padrão), qualquer linha com erro cancela o envio inteiro;
+    com atomic=0, as linhas válidas são gravadas e as outras são ignoradas.
+    """
+    # Opções pela query string, pelo formulário do upload ou pelo próprio JSON
+    payload = None if 'file' in request.files else request.get_json(silent=True)
+    options = {**request.args, **request.form}
+    if isinstance(payload, dict):
+        options.update({k: v for k, v in payload.items() if k != 'items'})
+    dry_run = str(options.get('dry_run', '0')).lower() in ('1', 'true', 'sim')
+    atomic = str(options.get('atomic', '1')).lower() not in ('0', 'false', 'nao', 'não')
+
+    try:
+        if 'file' in request.files:
+            frame = stock_bulk.read_upload(request.files['file'])
+        elif payload is not None:
+            frame = stock_bulk.read_json(payload)
+        else:
+            return jsonify({"error": "Envie uma lista JSON ou uma planilha no campo 'file'."}), 400
+    except stock_bulk.BulkInputError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        # A trava de escrita vem antes da leitura: o diff é feito sobre o estoque que será alterado
+        if not dry_run:
+            cursor.execute("BEGIN IMMEDIATE")
+        results, updates, inserts = stock_bulk.plan(cursor, frame)
+        failed = sum(1 for r in results if r["status"] == "error")
+        summary = {
+            "dry_run": dry_run,
+            "atomic": atomic,
+            "rows": len(results),
+            "errors": failed,
+            "updated": len(updates),
+            "created": len(inserts),
+            "unchanged": sum(1 for r in results if r["action"] == "unchanged" and r["status"] == "ok"),
+        }
+
+        if dry_run or (atomic and failed) or not (updates or inserts):
+            conn.rollback()
+            applied = False
+        else:
+            created = stock_bulk.apply(cursor, updates, inserts)
+            changes.bus.record(cursor, 'stock', 'menu_changed')
+            conn.commit()
+            menu.invalidate()
+            changes.bus.wake()
+            applied = True
+            # Os itens novos recebem o id gerado pelo INSERT
+            created_ids = iter(created)
+            for r in results:
+                if r["action"] == "create" and r["status"] == "ok":
+                    r["id"] = next(created_ids)
+
+        # 422: o envio foi recusado inteiro por causa das linhas com erro
+        status_code = 422 if failed and atomic and not dry_run else 200
+        return jsonify({**summary, "applied": applied, "results": results}), status_code
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.release_connection(conn)
 
 @app.route('/api/admin/stock/<int:item_id>', methods=['DELETE'])
 def delete_stock_item(item_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("DELETE FROM stock WHERE id = ?", (item_id,))
-        conn.commit()
         if cursor.rowcount == 0: return jsonify({"message": "Item não encontrado."}), 404
+        changes.bus.record(cursor, 'stock', 'menu_changed')
+        conn.commit()
+        menu.invalidate()
+        changes.bus.wake()
         return jsonify({"message": "Item excluído!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
         
 @app.route('/api/admin/sales/<int:sale_id>', methods=['DELETE'])
 def delete_sale(sale_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM orders WHERE id = ?", (sale_id,))
+        # A venda pode estar na tabela viva ou já arquivada
+        cursor.execute("SELECT status, 0 FROM orders WHERE id = ? UNION ALL SELECT status, 1 FROM orders_archive WHERE id = ?",
+                       (sale_id, sale_id))
+        order = cursor.fetchone()
+        if not order: return jsonify({"message": "Pedido não encontrado."}), 404
+        status, archived = order[0], bool(order[1])
+        # Pedidos recusados já foram retirados dos totais de vendas
+        if status != 'rejected':
+            sales.remove_order(cursor, sale_id, archived)
+        if archived:
+            cursor.execute("DELETE FROM order_items_archive WHERE order_id = ?", (sale_id,))
+            cursor.execute("DELETE FROM orders_archive WHERE id = ?", (sale_id,))
+        else:
+            cursor.execute("DELETE FROM orders WHERE id = ?", (sale_id,))
+        changes.bus.record(cursor, 'orders', 'order_deleted', order_id=sale_id)
         conn.commit()
-        if cursor.rowcount == 0: return jsonify({"message": "Pedido não encontrado."}), 404
+        board.invalidate()
+        # Os relatórios não podem continuar mostrando a venda excluída
+        reporting.invalidate()
+        changes.bus.wake()
         return jsonify({"message": "Pedido excluído!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/admin/sales/analysis', methods=['GET'])
 def get_sales_analysis():
-    conn = sqlite3.connect('database.db')
+    # Filtro opcional por período: ?from=AAAA-MM-DD&to=AAAA-MM-DD (inclusivo)
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    try:
+        for value in (date_from, date_to):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Datas devem estar no formato AAAA-MM-DD."}), 400
+
+    conn = reporting.get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT item_names, quantities FROM orders")
-        orders = cursor.fetchall()
-        item_sales = defaultdict(int)
-        
-        for names_json, quantities_json in orders:
-            try:
-                # CORREÇÃO: Usar json.loads para decodificar as strings JSON
-                item_names_list = json.loads(names_json)
-                item_quantities_list = json.loads(quantities_json)
-                
-                # Garante que as quantidades sejam inteiros
-                item_quantities_list = [int(q) for q in item_quantities_list]
-                
-                for name, quantity in zip(item_names_list, item_quantities_list):
-                    item_sales[name] += quantity
-            except (json.JSONDecodeError, TypeError, ValueError) as e:
-                # Continua mesmo se um pedido antigo tiver formato inválido
-                print(f"Erro ao analisar dados de vendas (pulando pedido): {e}")
-                continue
-
-        if not item_sales: return jsonify({"most_sold": None, "least_sold": None, "sales_data": []}), 200
-        
-        most_sold_item = max(item_sales.items(), key=lambda item: item[1])
-        least_sold_item = min(item_sales.items(), key=lambda item: item[1])
-        sales_data = [{"name": name, "quantity": quantity} for name, quantity in item_sales.items()]
-        
-        return jsonify({"most_sold": {"name": most_sold_item[0], "quantity": most_sold_item[1]}, "least_sold": {"name": least_sold_item[0], "quantity": least_sold_item[1]}, "sales_data": sales_data}), 200
+        # Lê os totais já somados (sales_item_totals / sales_daily / sales_hourly)
+        data_as_of = reporting.as_of(conn)
+        report = {**sales.analysis_report(cursor, date_from, date_to), "data_as_of": data_as_of}
+        return reporting.stamp(jsonify(report), data_as_of), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        reporting.release_connection(conn)
 
 @app.route('/api/admin/sales/export', methods=['GET'])
 def export_sales_to_excel():
-    conn = sqlite3.connect('database.db')
-    try:
-        df = pd.read_sql_query("SELECT id as 'ID', order_number as 'Senha', customer_name as 'Cliente', item_names as 'Itens', quantities as 'Quantidades', total as 'Total (R$)', payment_method as 'Pagamento', created_at as 'Data/Hora' FROM orders ORDER BY created_at DESC", conn)
-        df['Data/Hora'] = pd.to_datetime(df['Data/Hora']).dt.strftime('%d/%m/%Y %H:%M:%S')
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Vendas')
-        output.seek(0)
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        return send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheet.sheet', as_attachment=True, download_name=f"relatorio_vendas_{timestamp}.xlsx")
+    # Filtros opcionais: ?from=AAAA-MM-DD&to=AAAA-MM-DD&status=completed,ready
+    # Formato: ?format=xlsx (padrão) ou ?format=csv
+    export_format = request.args.get('format', 'xlsx').lower()
+    statuses = [s for s in request.args.get('status', '').split(',') if s]
+    try:
+        sql, params = sales_export.build_query(request.args.get('from'), request.args.get('to'), statuses)
+    except ValueError:
+        return jsonify({"error": "Datas devem estar no formato AAAA-MM-DD."}), 400
+
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({"error": "Formato inválido. Use 'xlsx' ou 'csv'."}), 400
+
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    conn = reporting.get_connection()
+    try:
+        data_as_of = reporting.as_of(conn)
+        if export_format == 'csv':
+            # O CSV é enviado enquanto as linhas são lidas do banco. A conexão é
+            # devolvida quando a resposta é fechada (fim do envio ou cliente desconectado)
+            response = Response(sales_export.stream_csv(sql, params, source=reporting, conn=conn), mimetype='text/csv', headers={
+                'Content-Disposition': f'attachment; filename=relatorio_vendas_{timestamp}.csv',
+                'X-Data-As-Of': data_as_of,
+            })
+            response.call_on_close(lambda stream_conn=conn: reporting.release_connection(stream_conn))
+            conn = None
+            return response
+
+        output = sales_export.write_xlsx(sql, params, source=reporting, conn=conn)
+        return reporting.stamp(send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=f"relatorio_vendas_{timestamp}.xlsx"), data_as_of)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        reporting.release_connection(conn)
+
+# Jobs em segundo plano (exportação/análise de vendas): cria, acompanha e baixa o resultado
+@app.route('/api/admin/jobs/<kind>', methods=['POST'])
+def create_job(kind):
+    # Mesmos parâmetros das rotas síncronas, pela query string ou pelo JSON
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "O corpo JSON deve ser um objeto com os parâmetros do job."}), 400
+    args = {**request.args, **payload}
+    try:
+        job, reused = jobs.runner.submit(kind, args)
+    except jobs.JobError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    response = jsonify({**job, "reused": reused})
+    response.headers['Location'] = url_for('get_job', job_id=job["id"])
+    return response, 202
+
+@app.route('/api/admin/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(jobs.runner.list()), 200
+
+@app.route('/api/admin/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.runner.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado ou expirado."}), 404
+    return jsonify(job), 200
+
+@app.route('/api/admin/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = jobs.runner.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado ou expirado."}), 404
+    if job["status"] == 'failed':
+        return jsonify({"error": job["error"]}), 500
+    if job["status"] != 'done':
+        return jsonify({"error": "O job ainda não terminou.", "status": job["status"], "progress": job["progress"]}), 409
+    path = jobs.runner.result_path(job)
+    if job["result"]["mimetype"] == 'application/json':
+        return send_file(os.path.abspath(path), mimetype='application/json', max_age=0)
+    return send_file(os.path.abspath(path), mimetype=job["result"]["mimetype"], as_attachment=True,
+                     download_name=job["result"]["file"], max_age=0)
+
+# Cópia do banco usada pelos relatórios: estado e atualização sob demanda
+@app.route('/api/admin/reporting', methods=['GET'])
+def get_reporting_status():
+    return jsonify(reporting.stats()), 200
+
+@app.route('/api/admin/reporting/refresh', methods=['POST'])
+def refresh_reporting():
+    if reporting.MODE != 'snapshot':
+        return jsonify({"error": f"REPORTING_MODE={reporting.MODE} não usa cópia."}), 400
+    try:
+        return jsonify({"data_as_of": reporting.refresh(), **reporting.stats()}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Contadores do pool de conexões do SQLite (diagnóstico de lentidão)
+@app.route('/api/admin/db/stats', methods=['GET'])
+def get_db_stats():
+    return jsonify(db.stats()), 200
+
+# Métricas no formato do Prometheus (latência por rota, tempo de SQL, pool e fila)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    gauges = {f"sqlite_pool_{key}": value for key, value in db.stats().items()}
+    gauges.update({f"order_ingest_{key}": value for key, value in ingest.writer.stats().items()})
+    gauges["order_status_long_polls_waiting"] = events.order_status.waiting()
+    gauges.update({f"order_board_{key}": value for key, value in board.stats().items()})
+    gauges["screen_response_cache_hits"] = responses.screens.hits
+    gauges["screen_response_cache_misses"] = responses.screens.misses
+    gauges.update({f"admin_jobs_{key}": value for key, value in jobs.runner.stats().items()})
+    gauges["reporting_snapshot_age_seconds"] = reporting.stats()["snapshot_age_seconds"] or 0
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# Confere o quadro de pedidos em memória contra o banco (?repair=1 recarrega se divergir)
+@app.route('/api/admin/board/verify', methods=['GET'])
+def verify_order_board():
+    try:
+        return jsonify(board.verify(repair=request.args.get('repair') == '1')), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Métricas da fila de gravação em lote (tamanho da fila, lotes, tempo de commit)
+@app.route('/api/admin/orders/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    return jsonify(ingest.writer.stats()), 200
 
 # ROTA ADICIONADA PARA CORRIGIR O ERRO
 @app.route('/api/admin/orders/reset', methods=['POST'])
 def reset_orders():
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
-        # Apaga todos os registros da tabela de pedidos
-        cursor.execute("DELETE FROM orders")
-        # Opcional, mas recomendado: Reseta o contador de autoincremento do SQLite
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='orders'")
+        cursor.execute("BEGIN IMMEDIATE")
+        # Move todos os pedidos para o arquivo (o histórico de vendas continua na
+        # análise e na exportação). O contador de ids (sqlite_sequence) NÃO é
+        # zerado, para que os ids novos não colidam com os arquivados.
+        archived = archive.archive_all(cursor)
+        # Senhas voltam a começar do 001
+        cursor.execute("UPDATE order_sequence SET last_value = 0, period = '' WHERE name = 'orders'")
+        changes.bus.record(cursor, 'orders', 'orders_reset', archived_orders=archived)
         conn.commit()
-        return jsonify({"message": "Senhas e vendas reiniciadas com sucesso!"}), 200
+        board.invalidate()
+        reporting.invalidate()
+        changes.bus.wake()
+        return jsonify({"message": "Senhas reiniciadas com sucesso! Pedidos anteriores foram arquivados.",
+                        "archived_orders": archived}), 200
     except Exception as e:
         conn.rollback()
         # Log do erro no servidor para depuração
         print(f"Erro ao reiniciar senhas: {e}")
         return jsonify({"error": "Ocorreu um erro interno no servidor."}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
+
+# Arquivamento dos pedidos concluídos/recusados antigos
+@app.route('/api/admin/orders/archive', methods=['GET', 'POST'])
+def archive_orders():
+    conn = db.get_connection()
+    try:
+        if request.method == 'GET':
+            return jsonify(archive.stats(conn.cursor())), 200
+        data = request.get_json(silent=True) or {}
+        try:
+            days = int(data.get('days', archive.ARCHIVE_AFTER_DAYS))
+        except (TypeError, ValueError):
+            return jsonify({"error": "O campo 'days' deve ser um número inteiro."}), 400
+        if days < 0:
+            return jsonify({"error": "O campo 'days' não pode ser negativo."}), 400
+        moved = archive.archive_finished(conn, days)
+        if moved:
+            board.invalidate()
+            reporting.invalidate()
+            changes.bus.wake()
+        return jsonify({"message": f"{moved} pedidos arquivados.", "archived_orders": moved}), 200
+    except Exception as e:
+        print(f"Erro ao arquivar pedidos: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.release_connection(conn)
 
 # --- API para a Cozinha ---
 @app.route('/api/kitchen/orders', methods=['GET'])
 def get_kitchen_orders():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, order_number, customer_name, item_names, quantities FROM orders WHERE status = 'preparing' ORDER BY created_at ASC")
-        
-        orders = []
-        for r in cursor.fetchall():
-            try:
-                # CORREÇÃO: Usar json.loads para decodificar as strings JSON
-                items_list = json.loads(r[3])
-                quantities_list = json.loads(r[4])
-                
-                orders.append({
-                    "id": r[0],
-                    "order_number": r[1],
-                    "customer_name": r[2],
-                    "items": items_list,       # Agora é uma lista Python
-                    "quantities": quantities_list # Agora é uma lista Python
-                })
-            except json.JSONDecodeError as e:
-                print(f"Erro ao decodificar JSON do pedido {r[1]} da cozinha: {e}")
-                continue # Pula este pedido se o JSON estiver mal formatado
-
-        return jsonify(orders)
+        entry = responses.screens.get('kitchen_orders', events.broker.last_id, board.kitchen_view)
+        return responses.send(entry)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/kitchen/order/ready/<int:order_id>', methods=['POST'])
 def mark_order_as_ready(order_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("UPDATE orders SET status = 'ready' WHERE id = ?", (order_id,))
-        conn.commit()
         if cursor.rowcount == 0: return jsonify({"error": "Pedido não encontrado"}), 404
+        changes.bus.record(cursor, 'orders', 'order_ready', order_id=order_id, status='ready')
+        conn.commit()
+        board.set_status(order_id, 'ready')
+        changes.bus.wake()
         return jsonify({"message": "Pedido marcado como pronto!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 # --- API para Gerente e Monitor (com sistema de status) ---
 @app.route('/api/monitor/orders', methods=['GET'])
 def get_monitor_orders():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT order_number, customer_name, status FROM orders WHERE status IN ('preparing', 'ready') ORDER BY created_at ASC")
-        preparing = [{"order": r[0], "name": r[1], "status": r[2]} for r in cursor.fetchall()]
-        
-        cursor.execute("SELECT order_number, customer_name FROM orders WHERE status = 'completed' ORDER BY called_at DESC LIMIT 6")
-        ready = [{"order": r[0], "name": r[1]} for r in cursor.fetchall()]
-        
-        return jsonify({"preparing": preparing, "ready": ready}), 200
+        entry = responses.screens.get('monitor_orders', events.broker.last_id, board.monitor_view)
+        return responses.send(entry)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/manager/next_order', methods=['POST'])
 def get_next_order():
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, customer_name, order_number FROM orders WHERE status = 'ready' ORDER BY created_at ASC LIMIT 1")
-        order = cursor.fetchone()
+        # Horário da chamada em ms (UTC) e no texto com o horário de Brasília (formato antigo)
+        called_ms = timeutil.now_ms()
+        called_time_brt = timeutil.local_now(called_ms)
+
+        # O candidato vem do quadro em memória; o UPDATE só vale se ele ainda estiver 'ready'
+        candidate = board.next_ready()
+        order = None
+        if candidate:
+            cursor.execute('''
+                UPDATE orders SET status = 'completed', called_at = ?, called_at_ms = ? WHERE id = ? AND status = 'ready'
+                RETURNING id, customer_name, order_number
+            ''', (called_time_brt, called_ms, candidate.id))
+            order = cursor.fetchone()
+        if order is None:
+            # Quadro vazio ou desatualizado: o banco escolhe e atualiza em um único comando
+            cursor.execute('''
+                UPDATE orders SET status = 'completed', called_at = ?, called_at_ms = ?
+                WHERE id = (SELECT id FROM orders WHERE status = 'ready' ORDER BY created_at ASC LIMIT 1)
+                RETURNING id, customer_name, order_number
+            ''', (called_time_brt, called_ms))
+            order = cursor.fetchone()
+            if candidate:
+                board.invalidate()
         if order:
             order_id, customer_name, order_number = order
-            # NOVO: Define o horário de Brasília (UTC-3) para a chamada
-            called_time_brt = datetime.utcnow() - timedelta(hours=3)
-            # ALTERADO: Usa a variável com o horário de Brasília para atualizar 'called_at'
-            cursor.execute("UPDATE orders SET status = 'completed', called_at = ? WHERE id = ?", (called_time_brt, order_id))
+            changes.bus.record(cursor, 'orders', 'order_called', order_id=order_id, order_number=order_number,
+                               customer_name=customer_name, status='completed')
             conn.commit()
+            board.set_status(order_id, 'completed', expected_from='ready')
+            changes.bus.wake()
             return jsonify({"success": True, "customer_name": customer_name, "order_number": order_number}), 200
         else:
             return jsonify({"success": False, "message": "Nenhum pedido pronto para chamar."}), 404
@@ -650,20 +995,14 @@ def get_next_order():
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
         
 @app.route('/api/manager/ready-orders-count', methods=['GET'])
 def get_ready_orders_count():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT COUNT(id) FROM orders WHERE status = 'ready'")
-        count = cursor.fetchone()[0]
-        return jsonify({"ready_count": count})
+        return jsonify({"ready_count": board.ready_count()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/admin/stock/update', methods=['POST'])
 def update_stock_item():
@@ -675,37 +1014,43 @@ def update_stock_item():
     if not all([item_id, new_price is not None, new_quantity is not None]):
         return jsonify({"error": "ID, preço e quantidade são obrigatórios."}), 400
 
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("UPDATE stock SET price = ?, quantity = ? WHERE id = ?",
                        (float(new_price), int(new_quantity), int(item_id)))
-        conn.commit()
         if cursor.rowcount == 0:
             return jsonify({"message": "Item não encontrado."}), 404
+        changes.bus.record(cursor, 'stock', 'menu_changed')
+        conn.commit()
+        menu.invalidate()
+        changes.bus.wake()
         return jsonify({"message": "Item atualizado com sucesso!"}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 @app.route('/api/admin/stock/toggle_availability/<int:item_id>', methods=['POST'])
 def toggle_availability(item_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         # Inverte o valor atual (se for 1, vira 0; se for 0, vira 1)
         cursor.execute("UPDATE stock SET is_available = 1 - is_available WHERE id = ?", (item_id,))
-        conn.commit()
         if cursor.rowcount == 0:
             return jsonify({"error": "Item não encontrado."}), 404
+        changes.bus.record(cursor, 'stock', 'menu_changed')
+        conn.commit()
+        menu.invalidate()
+        changes.bus.wake()
         return jsonify({"message": "Status do item alterado com sucesso."}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 # ROTA ADICIONADA PARA SERVIR ARQUIVOS ESTÁTICOS (SOM)
 @app.route('/static/<path:filename>')
@@ -714,86 +1059,248 @@ def serve_static(filename):
 
 @app.route('/api/admin/pending_payments', methods=['GET'])
 def get_pending_payments():
-    conn = sqlite3.connect('database.db')
+    # Conexão somente leitura no banco principal: o caixa precisa ver os pedidos na hora
+    conn = reporting.get_connection(live=True)
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT id, order_number, customer_name, total, created_at FROM orders WHERE status = 'pending_payment' ORDER BY created_at DESC")
         pending = [{"id": r[0], "order_number": r[1], "customer_name": r[2], "total": r[3], "created_at": r[4]} for r in cursor.fetchall()]
-        return jsonify(pending), 200
+        return reporting.stamp(jsonify(pending), reporting.as_of(conn)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        reporting.release_connection(conn)
 
 # Rota para o ADMIN aprovar o pagamento
 @app.route('/api/admin/approve_payment/<int:order_id>', methods=['POST'])
 def approve_payment(order_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("UPDATE orders SET status = 'preparing' WHERE id = ?", (order_id,))
+        if cursor.rowcount:
+            changes.bus.record(cursor, 'orders', 'payment_approved', order_id=order_id, status='preparing')
         conn.commit()
+        if cursor.rowcount:
+            board.set_status(order_id, 'preparing')
+            changes.bus.wake()
         return jsonify({"message": "Pagamento aprovado! Pedido enviado para a cozinha."}), 200
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        db.release_connection(conn)
 
 # Rota para o ADMIN RECUSAR o pagamento (Devolve itens ao estoque)
 @app.route('/api/admin/reject_payment/<int:order_id>', methods=['POST'])
 def reject_payment(order_id):
-    conn = sqlite3.connect('database.db')
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
-        # 1. Busca os itens do pedido para devolver ao estoque
-        cursor.execute("SELECT item_names, quantities FROM orders WHERE id = ?", (order_id,))
-        order = cursor.fetchone()
-        
-        if not order:
-            return jsonify({"error": "Pedido não encontrado"}), 404
+        # 1. Marca o pedido como recusado ANTES de devolver o estoque. O UPDATE
+        # abre a transação de escrita: com dois cliques ao mesmo tempo, só um
+        # muda o status e o outro recebe 409 (o estoque não volta duas vezes).
+        cursor.execute("UPDATE orders SET status = 'rejected' WHERE id = ? AND status != 'rejected'", (order_id,))
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT 1 FROM orders WHERE id = ?", (order_id,))
+            if not cursor.fetchone():
+                return jsonify({"error": "Pedido não encontrado"}), 404
+            return jsonify({"error": "Este pedido já foi recusado."}), 409
 
-        item_names_json, quantities_json = order
-        
-        # Decodifica os JSONs
-        item_names = json.loads(item_names_json)
-        quantities = json.loads(quantities_json)
-
-        # 2. Devolve cada item ao estoque
-        # Nota: Estamos buscando pelo NOME porque o ID não foi salvo no JSON original do pedido, 
-        # mas o ideal seria salvar o ID. Como seu sistema salva nomes, vamos pelo nome.
-        for name, qty in zip(item_names, quantities):
-            cursor.execute("UPDATE stock SET quantity = quantity + ? WHERE name = ?", (qty, name))
-
-        # 3. Atualiza o status do pedido para 'rejected'
-        cursor.execute("UPDATE orders SET status = 'rejected' WHERE id = ?", (order_id,))
+        # 2. Devolve ao estoque pelo ID do item (order_items), em um único UPDATE
+        cursor.execute('''
+            UPDATE stock
+            SET quantity = quantity + (
+                SELECT SUM(oi.quantity) FROM order_items oi
+                WHERE oi.order_id = ? AND oi.stock_id = stock.id
+            )
+            WHERE id IN (SELECT stock_id FROM order_items WHERE order_id = ?)
+        ''', (order_id, order_id))
+
+        # Retira o pedido dos totais de vendas
+        sales.remove_order(cursor, order_id)
+
+        changes.bus.record(cursor, 'orders', 'payment_rejected', order_id=order_id, status='rejected')
         
         conn.commit()
+        menu.quantities_changed()
+        board.set_status(order_id, 'rejected')
+        changes.bus.wake()
         return jsonify({"message": "Pagamento recusado e itens devolvidos ao estoque."}), 200
     except Exception as e:
         conn.rollback()
         print(f"Erro ao recusar pedido: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()       
+        db.release_connection(conn)       
 
 # Rota para o CLIENTE verificar se foi aprovado (Polling)
+# Tempo máximo (segundos) que o long-poll do status do pedido segura a resposta.
+# Mudanças feitas em outros workers também acordam a espera, pelo barramento de
+# mudanças (changes.py), em até CHANGE_BUS_POLL_MS.
+MAX_STATUS_WAIT_SECONDS = float(os.environ.get('ORDER_STATUS_MAX_WAIT_SECONDS', '30'))
+
 @app.route('/api/orders/check_status/<int:order_id>', methods=['GET'])
 def check_order_status_api(order_id):
-    conn = sqlite3.connect('database.db')
+    # Long-poll: ?wait=N&status=<status que o cliente já conhece> segura a
+    # resposta por até N segundos e responde assim que o status mudar
+    known_status = request.args.get('status')
+    try:
+        wait_seconds = min(float(request.args.get('wait', 0)), MAX_STATUS_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "Parâmetro 'wait' inválido."}), 400
+    if wait_seconds > 0 and known_status:
+        # Mudanças feitas por outros workers também acordam a espera
+        changes.bus.ensure_started()
+    waiter = events.order_status.register(order_id) if wait_seconds > 0 and known_status else None
+
+    conn = db.get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
         row = cursor.fetchone()
-        if row:
-            return jsonify({"status": row[0]}), 200
-        return jsonify({"status": "unknown"}), 404
     except Exception as e:
+        if waiter:
+            events.order_status.unregister(order_id, waiter)
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        # A conexão volta ao pool antes da espera
+        db.release_connection(conn)
+
+    if not row:
+        if waiter:
+            events.order_status.unregister(order_id, waiter)
+        return jsonify({"status": "unknown"}), 404
+
+    status = row[0]
+    if waiter and status == known_status:
+        # Acorda com o status publicado pelas rotas (aprovar, recusar, pronto...)
+        if waiter.event.wait(wait_seconds) and waiter.status:
+            status = waiter.status
+    if waiter:
+        events.order_status.unregister(order_id, waiter)
+    return jsonify({"status": status}), 200
+
+# --- Eventos em tempo real (SSE) para cozinha, monitor, gerente e clientes ---
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    # O navegador reenvia o último id recebido no cabeçalho Last-Event-ID ao reconectar.
+    # O parâmetro ?last_event_id= serve para clientes que não usam EventSource.
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
+
+    changes.bus.ensure_started()
+    return Response(events.broker.stream(last_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Impede o nginx de segurar os eventos em buffer
+    })
+
+# --- Comandos de manutenção (flask --app app <comando>) ---
+@app.cli.command('rebuild-sales-aggregates')
+def rebuild_sales_aggregates_command():
+    """Recalcula os totais de vendas a partir de todos os pedidos."""
+    init_db()
+    conn = db.get_connection()
+    try:
+        sales.rebuild(conn.cursor())
+        conn.commit()
+        print("Totais de vendas recalculados.")
+    finally:
+        db.release_connection(conn)
+
+@app.cli.command('archive-orders')
+@click.option('--days', default=archive.ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Idade mínima (dias) dos pedidos concluídos/recusados a arquivar.')
+def archive_orders_command(days):
+    """Move os pedidos concluídos/recusados antigos para orders_archive."""
+    init_db()
+    conn = db.get_connection()
+    try:
+        moved = archive.archive_finished(conn, days)
+        if moved:
+            reporting.invalidate()
+        print(f"{moved} pedidos arquivados.")
+    finally:
+        db.release_connection(conn)
+
+@app.cli.command('process-images')
+def process_images_command():
+    """Gera as versões reduzidas das fotos enviadas antes do processamento de imagens."""
+    init_db()
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, image_path FROM stock WHERE image_variants IS NULL AND image_path LIKE '/uploads/%'")
+        updated = 0
+        with app.test_request_context():
+            for item_id, image_path in cursor.fetchall():
+                path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(image_path))
+                if not os.path.exists(path):
+                    print(f"Item {item_id}: arquivo {path} não encontrado.")
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                try:
+                    image_url, image_variants = images.process_upload(
+                        data, path, app.config['UPLOAD_FOLDER'],
+                        lambda name: url_for('uploaded_file', filename=name, _external=False))
+                except images.InvalidImage as e:
+                    print(f"Item {item_id}: {e}")
+                    continue
+                cursor.execute("UPDATE stock SET image_path = ?, image_variants = ? WHERE id = ?",
+                               (image_url, json.dumps(image_variants) if image_variants else None, item_id))
+                updated += 1
+        if updated:
+            changes.bus.record(cursor, 'stock', 'menu_changed')
+        conn.commit()
+        print(f"{updated} imagens processadas.")
+    finally:
+        db.release_connection(conn)
+
+@app.cli.command('refresh-reporting')
+def refresh_reporting_command():
+    """Refaz a cópia do banco lida pelos relatórios (para agendar no cron)."""
+    init_db()
+    print(f"Cópia dos relatórios com dados de {reporting.refresh()} UTC.")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria as tabelas e aplica as migrações pendentes."""
+    init_db()
+    print("Banco de dados pronto.")
 
 # 6. INICIALIZAÇÃO DO SERVIDOR
+_db_initialized = False
+
+def create_app():
+    """
+    Ponto de entrada de produção (wsgi.py). Roda init_db uma única vez por
+    processo; com TORTAS_DB_INITIALIZED=1 (definido pelo gunicorn.conf.py
+    depois de preparar o banco no processo principal) os workers não repetem.
+    """
+    global _db_initialized
+    if not _db_initialized and os.environ.get('TORTAS_DB_INITIALIZED') != '1':
+        init_db()
+    _db_initialized = True
+    # Carrega o quadro de pedidos das telas e passa a ouvir as mudanças dos outros processos
+    board.load()
+    changes.bus.ensure_started()
+    return app
+
+def shutdown():
+    """Desligamento gracioso: grava a fila de pedidos, encerra os streams e fecha o pool."""
+    ingest.writer.stop()
+    changes.bus.stop()
+    events.broker.close()
+    events.order_status.close()
+    jobs.runner.shutdown()
+    reporting.close_all()
+
 if __name__ == '__main__':
-    init_db()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Servidor de desenvolvimento. Em produção use: gunicorn -c gunicorn.conf.py wsgi:app
+    create_app()
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '5000')),
+            debug=os.environ.get('FLASK_DEBUG', '0') == '1', threaded=True)
@@ -0,0 +1,148 @@
+# archive.py
+# Arquivamento dos pedidos antigos (tabelas "quentes" e "frias").
+#
+# Os pedidos concluídos ou recusados há mais de ARCHIVE_AFTER_DAYS dias saem
+# de orders/order_items e vão para orders_archive/order_items_archive, no
+# mesmo arquivo do banco. Assim a tabela orders fica só com o movimento
+# recente e as consultas das telas continuam rápidas.
+#
+# O histórico continua disponível:
+#   - a análise de vendas lê os agregados (sales.py), que NÃO mudam ao arquivar;
+#   - a lista de vendas e a exportação consultam as duas tabelas (view orders_all).
+# Os ids são preservados: o contador AUTOINCREMENT de orders nunca é zerado,
+# então um pedido novo jamais reaproveita o id de um pedido arquivado.
+
+import os
+
+import changes
+import timeutil
+
+# Idade mínima (em dias) para um pedido concluído/recusado ser arquivado
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+
+# Pedidos movidos por transação (mantém curtas as travas de escrita)
+BATCH_SIZE = 2000
+
+# Status que podem ser arquivados pelo job (os outros ainda estão em andamento)
+FINISHED_STATUSES = ('completed', 'rejected')
+
+# Colunas copiadas de orders para orders_archive (mesma ordem nas duas tabelas)
+ORDER_COLUMNS = ('id', 'customer_name', 'phone', 'item_names', 'quantities', 'total', 'order_number',
+                 'payment_method', 'created_at', 'called_at', 'status', 'created_at_ms', 'called_at_ms')
+ITEM_COLUMNS = ('id', 'order_id', 'stock_id', 'name_snapshot', 'quantity', 'unit_price')
+
+CREATE_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INTEGER PRIMARY KEY, -- mesmo id que o pedido tinha em orders
+        customer_name TEXT NOT NULL,
+        phone TEXT,
+        item_names TEXT NOT NULL,
+        quantities TEXT NOT NULL,
+        total REAL NOT NULL,
+        order_number TEXT NOT NULL,
+        payment_method TEXT NOT NULL,
+        created_at TIMESTAMP,
+        called_at TIMESTAMP,
+        status TEXT NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_at_ms INTEGER,
+        called_at_ms INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS order_items_archive (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        stock_id INTEGER,
+        name_snapshot TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price REAL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_order_items_archive_order ON order_items_archive(order_id)",
+    # Mesmos filtros da lista de vendas
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_created_ms ON orders_archive(created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_payment_created_ms ON orders_archive(payment_method, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive(customer_name COLLATE NOCASE)",
+)
+
+
+def create_tables(cursor):
+    """Cria as tabelas de arquivo."""
+    for statement in CREATE_TABLES:
+        cursor.execute(statement)
+
+
+def create_view(cursor):
+    """(Re)cria a view orders_all com as colunas atuais (depois das migrações)."""
+    columns = ', '.join(ORDER_COLUMNS)
+    cursor.execute("DROP VIEW IF EXISTS orders_all")
+    cursor.execute(f'''
+        CREATE VIEW orders_all AS
+        SELECT {columns} FROM orders
+        UNION ALL
+        SELECT {columns} FROM orders_archive
+    ''')
+
+
+def _move(cursor, order_ids_json):
+    """Copia os pedidos (e itens) da lista JSON de ids para o arquivo e apaga os originais."""
+    order_columns = ', '.join(ORDER_COLUMNS)
+    item_columns = ', '.join(ITEM_COLUMNS)
+    cursor.execute(f'''
+        INSERT INTO order_items_archive ({item_columns})
+        SELECT {item_columns} FROM order_items WHERE order_id IN (SELECT value FROM json_each(?))
+    ''', (order_ids_json,))
+    cursor.execute(f'''
+        INSERT INTO orders_archive ({order_columns})
+        SELECT {order_columns} FROM orders WHERE id IN (SELECT value FROM json_each(?))
+    ''', (order_ids_json,))
+    # Os itens saem junto (ON DELETE CASCADE)
+    cursor.execute("DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?))", (order_ids_json,))
+    return cursor.rowcount
+
+
+def archive_finished(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE):
+    """
+    Move os pedidos concluídos/recusados criados há mais de older_than_days
+    dias, em lotes de batch_size (uma transação por lote).
+    Retorna a quantidade de pedidos arquivados.
+    """
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(FINISHED_STATUSES))
+    cutoff_ms = timeutil.now_ms() - int(older_than_days) * timeutil.DAY_MS
+    moved = 0
+    while True:
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f'''
+                SELECT json_group_array(id) FROM (
+                    SELECT id FROM orders
+                    WHERE status IN ({placeholders}) AND created_at_ms < ?
+                    ORDER BY created_at_ms LIMIT ?
+                )
+            ''', (*FINISHED_STATUSES, cutoff_ms, batch_size))
+            count = _move(cursor, cursor.fetchone()[0])
+            if count:
+                changes.bus.record(cursor, 'orders', 'orders_archived', archived_orders=count)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+def archive_all(cursor):
+    """Move TODOS os pedidos para o arquivo (reinício das senhas). O chamador faz o commit."""
+    cursor.execute("SELECT json_group_array(id) FROM orders")
+    return _move(cursor, cursor.fetchone()[0])
+
+
+def stats(cursor):
+    """Quantidade de pedidos nas tabelas quente e fria."""
+    cursor.execute("SELECT (SELECT COUNT(*) FROM orders), (SELECT COUNT(*) FROM orders_archive)")
+    live, archived = cursor.fetchone()
+    return {"live_orders": live, "archived_orders": archived, "archive_after_days": ARCHIVE_AFTER_DAYS}
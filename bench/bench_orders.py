@@ -0,0 +1,347 @@
+# bench/bench_orders.py
+# Benchmark reproduzível do ciclo de vida dos pedidos.
+#
+# Cria um database.db temporário com um histórico configurável de pedidos e um
+# estoque realista, e então executa o fluxo real do app com N requisições
+# simultâneas, medindo latência (p50/p95/p99) e vazão de cada etapa:
+#   check_stock -> add_order -> approve_payment -> mark_order_as_ready ->
+#   get_next_order, mais o polling das telas e os relatórios do admin.
+# O resultado é salvo em JSON para comparar execuções.
+#
+# Uso (a partir da raiz do projeto):
+#   python bench/bench_orders.py --orders 100000 --concurrency 8 --output bench_results.json
+#   python bench/bench_orders.py --server http://127.0.0.1:5000 ...   (servidor já rodando)
+#   python bench/bench_orders.py --compare antes.json depois.json
+#
+# Com --server, o banco temporário NÃO é usado: o servidor deve ter sido
+# iniciado com TORTAS_DB_PATH apontando para um banco de teste (--seed-only
+# prepara esse banco e sai).
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATUSES_HISTORY = (('completed', 0.9), ('rejected', 0.05), ('preparing', 0.03), ('ready', 0.02))
+PAYMENT_METHODS = ('pix', 'dinheiro', 'cartao')
+
+
+# --- Preparação do banco ---
+
+def seed_database(app_module, orders, stock_items, seed):
+    """Cria o estoque e o histórico de pedidos direto no SQLite (em blocos)."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(app_module.db.DB_PATH)
+    cursor = conn.cursor()
+
+    stock = []
+    for i in range(stock_items):
+        stock.append((f"Torta {i + 1}", round(rng.uniform(5, 40), 2), 10_000_000,
+                      f"Descrição da torta {i + 1}", 0 if i % 25 == 24 else 1, 1 if i % 50 == 49 else 0))
+    cursor.executemany('''
+        INSERT INTO stock (name, price, quantity, detailed_description, is_available, is_promo)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', stock)
+    cursor.execute("SELECT id, name, price FROM stock")
+    stock_rows = cursor.fetchall()
+
+    statuses = [s for s, _ in STATUSES_HISTORY]
+    weights = [w for _, w in STATUSES_HISTORY]
+    start = datetime.utcnow() - timedelta(days=max(1, orders // 2000))
+    span_seconds = (datetime.utcnow() - start).total_seconds()
+
+    chunk = 20_000
+    order_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+    for offset in range(0, orders, chunk):
+        order_rows = []
+        item_rows = []
+        for n in range(offset, min(orders, offset + chunk)):
+            order_id += 1
+            lines = rng.sample(stock_rows, k=min(len(stock_rows), rng.randint(1, 4)))
+            quantities = [rng.randint(1, 3) for _ in lines]
+            created = start + timedelta(seconds=span_seconds * n / max(orders, 1))
+            status = rng.choices(statuses, weights)[0]
+            called = (created + timedelta(minutes=10) - timedelta(hours=3)) if status == 'completed' else None
+            order_rows.append((
+                order_id, f"Cliente {n % 997}", None,
+                json.dumps([name for _, name, _ in lines]), json.dumps(quantities),
+                round(sum(price * q for (_, _, price), q in zip(lines, quantities)), 2),
+                str(n % 999 + 1).zfill(3), rng.choice(PAYMENT_METHODS),
+                created.strftime('%Y-%m-%d %H:%M:%S'),
+                called.strftime('%Y-%m-%d %H:%M:%S') if called else None, status,
+                app_module.timeutil.to_ms(created),
+                app_module.timeutil.to_ms(called + timedelta(hours=3)) if called else None,  # called está em Brasília
+            ))
+            for (stock_id, name, price), q in zip(lines, quantities):
+                item_rows.append((order_id, stock_id, name, q, price))
+        cursor.executemany('''
+            INSERT INTO orders (id, customer_name, phone, item_names, quantities, total, order_number,
+                                payment_method, created_at, called_at, status, created_at_ms, called_at_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', order_rows)
+        cursor.executemany('''
+            INSERT INTO order_items (order_id, stock_id, name_snapshot, quantity, unit_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', item_rows)
+        conn.commit()
+
+    # Mantém os dados derivados coerentes com o histórico inserido
+    app_module.sales.rebuild(cursor)
+    cursor.execute("UPDATE order_sequence SET last_value = ? WHERE name = 'orders'", (orders % 999,))
+    conn.commit()
+    cursor.execute("ANALYZE")
+    # Os pedidos do benchmark só usam itens disponíveis e fora da promoção
+    cursor.execute("SELECT id FROM stock WHERE is_available = 1 AND is_promo = 0")
+    available_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return available_ids
+
+
+# --- Clientes (Flask test client ou servidor HTTP) ---
+
+class TestClient:
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def request(self, method, path, payload=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=payload)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self._base = base_url.rstrip('/')
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self._base + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# --- Execução e medição ---
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, operation, iterations, concurrency):
+    """Executa operation(i) 'iterations' vezes com 'concurrency' threads e mede cada chamada."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def task(i):
+        nonlocal errors
+        started = time.perf_counter()
+        ok = operation(i)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, range(iterations)))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    result = {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(iterations / wall, 2) if wall else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+    }
+    print(f"{name:<22} {iterations:>6} req  {result['throughput_rps'] or 0:>9.1f} req/s  "
+          f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  erros {errors}")
+    return result
+
+
+def run_lifecycle(client, stock_ids, args):
+    rng = random.Random(args.seed + 1)
+    results = {}
+    created_pix = []
+    created_cash = []
+    ids_lock = threading.Lock()
+
+    def cart():
+        return [{"id": item_id, "name": f"Torta {item_id}", "quantity": rng.randint(1, 2)}
+                for item_id in rng.sample(stock_ids, k=min(len(stock_ids), rng.randint(1, 4)))]
+
+    def check_stock(i):
+        status, _ = client.request('POST', '/api/stock/check', {"items": cart()})
+        return status == 200
+
+    def add_order(i):
+        payment = 'pix' if i % 2 else 'dinheiro'
+        status, body = client.request('POST', '/api/orders', {
+            "customer_name": f"Bench {i}", "phone": None, "items": cart(), "total": 10.0,
+            "payment_method": payment,
+        })
+        if status != 201:
+            return False
+        order_id = json.loads(body)["order_id"]
+        with ids_lock:
+            (created_pix if payment == 'pix' else created_cash).append(order_id)
+        return True
+
+    results["check_stock"] = run_scenario("check_stock", check_stock, args.requests, args.concurrency)
+    results["add_order"] = run_scenario("add_order", add_order, args.requests, args.concurrency)
+
+    results["approve_payment"] = run_scenario(
+        "approve_payment",
+        lambda i: client.request('POST', f'/api/admin/approve_payment/{created_pix[i]}')[0] == 200,
+        len(created_pix), args.concurrency)
+
+    preparing = created_pix + created_cash
+    results["mark_order_as_ready"] = run_scenario(
+        "mark_order_as_ready",
+        lambda i: client.request('POST', f'/api/kitchen/order/ready/{preparing[i]}')[0] == 200,
+        len(preparing), args.concurrency)
+
+    # Telas fazendo polling enquanto nada muda
+    for name, path in (("poll_kitchen", '/api/kitchen/orders'),
+                       ("poll_monitor", '/api/monitor/orders'),
+                       ("poll_status_board", '/api/orders/status'),
+                       ("poll_ready_count", '/api/manager/ready-orders-count'),
+                       ("poll_stock", '/api/stock')):
+        results[name] = run_scenario(name, lambda i, p=path: client.request('GET', p)[0] == 200,
+                                     args.requests, args.concurrency)
+
+    results["get_next_order"] = run_scenario(
+        "get_next_order",
+        lambda i: client.request('POST', '/api/manager/next_order')[0] == 200,
+        len(preparing), args.concurrency)
+
+    # Relatórios do admin (mais pesados: menos repetições)
+    admin_iterations = max(1, args.requests // 50)
+    for name, path in (("admin_sales_page", '/api/admin/sales?limit=50'),
+                       ("admin_analysis", '/api/admin/sales/analysis'),
+                       ("admin_export_csv", '/api/admin/sales/export?format=csv'),
+                       ("admin_export_xlsx", '/api/admin/sales/export')):
+        results[name] = run_scenario(name, lambda i, p=path: client.request('GET', p)[0] == 200,
+                                     admin_iterations, min(args.concurrency, 2))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new_path):
+    """Mostra a variação de p50/p99/vazão entre duas execuções salvas."""
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'cenário':<22} {'p50 (ms)':>20} {'p99 (ms)':>20} {'req/s':>20}")
+    for name in new:
+        if name not in old:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            a, b = old[name].get(key), new[name].get(key)
+            change = f"{(b - a) / a * 100:+.0f}%" if a and b is not None else "n/a"
+            cells.append(f"{a} -> {b} ({change})")
+        print(f"{name:<22} " + " ".join(f"{c:>20}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do ciclo de vida dos pedidos")
+    parser.add_argument('--orders', type=int, default=10_000, help="pedidos no histórico inicial")
+    parser.add_argument('--stock', type=int, default=40, help="itens no estoque")
+    parser.add_argument('--requests', type=int, default=500, help="requisições por cenário")
+    parser.add_argument('--concurrency', type=int, default=8, help="requisições simultâneas")
+    parser.add_argument('--seed', type=int, default=42, help="semente dos dados aleatórios")
+    parser.add_argument('--server', help="URL de um servidor já rodando (em vez do test client)")
+    parser.add_argument('--db', help="caminho do banco a criar (padrão: diretório temporário)")
+    parser.add_argument('--seed-only', action='store_true', help="só cria o banco e sai")
+    parser.add_argument('--output', default='bench_results.json', help="arquivo JSON de saída")
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DEPOIS'), help="compara dois resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='tortas-bench-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'database.db'))
+    output = os.path.abspath(args.output)
+
+    # A configuração do banco é lida na importação do app: define antes de importar.
+    # O app cria as pastas uploads/ e static/ no diretório atual, por isso o chdir.
+    os.environ['TORTAS_DB_PATH'] = db_path
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    print(f"Banco de teste: {db_path}")
+    app_module.init_db()
+    started = time.perf_counter()
+    stock_ids = seed_database(app_module, args.orders, args.stock, args.seed)
+    print(f"{args.orders} pedidos e {args.stock} itens criados em {time.perf_counter() - started:.1f}s")
+    if args.seed_only:
+        return
+
+    client = HttpClient(args.server) if args.server else TestClient(app_module.app)
+    results = run_lifecycle(client, stock_ids, args)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "client": "http" if args.server else "flask_test_client",
+            "orders": args.orders,
+            "stock": args.stock,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados salvos em {output}")
+
+
+if __name__ == '__main__':
+    main()
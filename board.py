@@ -0,0 +1,292 @@
+# board.py
+# Quadro de pedidos em memória: a fila viva que as telas mostram.
+#
+# Cozinha, monitor, painel de status e gerente consultavam o SQLite várias
+# vezes por segundo para ler sempre o mesmo conjunto pequeno de pedidos
+# (aguardando pagamento, em preparo e prontos). O quadro é carregado do banco
+# uma vez e depois atualizado pelas próprias rotas, logo após cada commit
+# ("write-through"): add_order, approve_payment, reject_payment,
+# mark_order_as_ready e get_next_order. As leituras das telas saem da memória,
+# com custo proporcional só aos pedidos visíveis.
+#
+# O banco continua sendo a fonte da verdade:
+#   - verify() compara o quadro com o banco e aponta divergências;
+#   - uma mudança que o quadro não reconhece (pedido desconhecido, operação
+#     em lote do admin) marca o quadro para ser recarregado na próxima leitura;
+#   - as mudanças feitas por outros processos chegam pelo barramento
+#     (changes.py) e marcam o quadro para recarregar; por segurança, ele também
+#     é recarregado a cada RESYNC_SECONDS.
+
+import bisect
+import os
+import threading
+import time
+from collections import deque
+
+import db
+
+# Intervalo máximo (segundos) entre recargas completas do quadro (0 = nunca)
+RESYNC_SECONDS = float(os.environ.get('BOARD_RESYNC_SECONDS', '30'))
+
+# Quantas senhas chamadas o monitor mostra
+CALLED_HISTORY = 6
+
+LIVE_STATUSES = ('pending_payment', 'preparing', 'ready')
+
+# INDEXED BY: sem estatísticas (banco novo), o planejador prefere os índices
+# (status, ...) e ordena em tabela temporária; o índice parcial já está na ordem.
+_LOAD_ORDERS = '''
+    SELECT o.id, o.order_number, o.customer_name, o.status, o.created_at, oi.name_snapshot, oi.quantity
+    FROM orders o INDEXED BY idx_orders_board
+    LEFT JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.status IN ('pending_payment', 'preparing', 'ready')
+    ORDER BY o.created_at ASC, o.id ASC, oi.id ASC
+'''
+_LOAD_CALLED = '''
+    SELECT id, order_number, customer_name FROM orders
+    WHERE status = 'completed' ORDER BY called_at_ms DESC LIMIT ?
+'''
+
+
+class BoardOrder:
+    __slots__ = ('id', 'order_number', 'customer_name', 'status', 'created_at', 'items')
+
+    def __init__(self, order_id, order_number, customer_name, status, created_at, items=None):
+        self.id = order_id
+        self.order_number = order_number
+        self.customer_name = customer_name
+        self.status = status
+        self.created_at = created_at or ''
+        self.items = items if items is not None else []  # [(nome, quantidade)]
+
+    @property
+    def key(self):
+        # Mesma ordem das consultas antigas: created_at, depois id
+        return (self.created_at, self.id)
+
+
+class _Snapshot:
+    """Estado completo do quadro (montado a partir do banco)."""
+
+    def __init__(self):
+        self.orders = {}
+        self.queues = {status: [] for status in LIVE_STATUSES}  # listas ordenadas por BoardOrder.key
+        self.called = deque(maxlen=CALLED_HISTORY)               # (id, senha, nome), mais recente primeiro
+
+    @classmethod
+    def from_db(cls, cursor):
+        snapshot = cls()
+        cursor.execute(_LOAD_ORDERS)
+        for order_id, number, name, status, created_at, item_name, quantity in cursor.fetchall():
+            order = snapshot.orders.get(order_id)
+            if order is None:
+                order = snapshot.orders[order_id] = BoardOrder(order_id, number, name, status, created_at)
+                snapshot.queues[status].append(order)
+            if item_name is not None:
+                order.items.append((item_name, quantity))
+        cursor.execute(_LOAD_CALLED, (CALLED_HISTORY,))
+        snapshot.called.extend(cursor.fetchall())
+        return snapshot
+
+
+class OrderBoard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._state = None
+        self._loaded_at = 0.0
+        self._pid = None
+        self._stale = True
+        self._mutations = 0  # Aumenta a cada atualização recebida (mesmo as ignoradas)
+
+    # --- Carga e consistência ---
+
+    def load(self):
+        """(Re)carrega o quadro inteiro do banco."""
+        with self._load_lock:
+            self._load_locked()
+
+    def _load_locked(self):
+        # A leitura do banco acontece FORA do self._lock: as rotas que atualizam
+        # o quadro podem estar segurando uma conexão do pool
+        mutations = self._mutations
+        conn = db.get_connection()
+        try:
+            state = _Snapshot.from_db(conn.cursor())
+        finally:
+            db.release_connection(conn)
+        with self._lock:
+            self._state = state
+            self._loaded_at = time.monotonic()
+            self._pid = os.getpid()
+            # Uma atualização chegou durante a leitura: ela pode não estar na foto
+            self._stale = self._mutations != mutations
+
+    def invalidate(self):
+        """Força a recarga na próxima leitura (ex: exclusão, reinício, arquivamento)."""
+        with self._lock:
+            self._mutations += 1
+            self._stale = True
+
+    def _needs_reload(self):
+        return (self._stale or self._state is None or self._pid != os.getpid()
+                or (RESYNC_SECONDS and time.monotonic() - self._loaded_at > RESYNC_SECONDS))
+
+    def _refresh(self):
+        """Recarrega se o quadro estiver marcado, vencido ou herdado de um fork (chamar sem o lock)."""
+        if self._needs_reload():
+            with self._load_lock:
+                # Outra requisição pode ter recarregado enquanto esta esperava
+                if self._needs_reload():
+                    self._load_locked()
+
+    def verify(self, repair=False):
+        """
+        Compara o quadro com o banco. Retorna um dict com as divergências
+        (ids faltando, sobrando, com status diferente e senhas chamadas).
+        Com repair=True, recarrega o quadro se houver divergência.
+        """
+        conn = db.get_connection()
+        try:
+            expected = _Snapshot.from_db(conn.cursor())
+        finally:
+            db.release_connection(conn)
+
+        self._refresh()
+        with self._lock:
+            current = self._state
+            missing = sorted(set(expected.orders) - set(current.orders))
+            extra = sorted(set(current.orders) - set(expected.orders))
+            status_mismatch = sorted(
+                order_id for order_id in set(expected.orders) & set(current.orders)
+                if expected.orders[order_id].status != current.orders[order_id].status
+                or expected.orders[order_id].items != current.orders[order_id].items)
+            order_mismatch = any(
+                [o.id for o in expected.queues[s]] != [o.id for o in current.queues[s]] for s in LIVE_STATUSES)
+            called_mismatch = [c[0] for c in expected.called] != [c[0] for c in current.called]
+
+        ok = not (missing or extra or status_mismatch or order_mismatch or called_mismatch)
+        if repair and not ok:
+            self.load()
+        return {
+            "ok": ok,
+            "missing": missing,
+            "extra": extra,
+            "status_mismatch": status_mismatch,
+            "order_mismatch": order_mismatch,
+            "called_mismatch": called_mismatch,
+            "repaired": repair and not ok,
+        }
+
+    # --- Atualizações (chamar DEPOIS do commit) ---
+
+    def add(self, order_id, order_number, customer_name, status, created_at, items):
+        """Pedido novo. items: [(nome, quantidade)] na ordem gravada em order_items."""
+        with self._lock:
+            self._mutations += 1
+            if self._state is None or self._stale:
+                return  # A próxima leitura recarrega tudo do banco, incluindo este pedido
+            state = self._state
+            if order_id in state.orders or status not in state.queues:
+                self._stale = True
+                return
+            order = BoardOrder(order_id, order_number, customer_name, status, created_at, list(items))
+            state.orders[order_id] = order
+            self._insert(state.queues[status], order)
+
+    def set_status(self, order_id, status, expected_from=None):
+        """
+        Move o pedido para a fila do novo status ('completed' vai para as
+        senhas chamadas; 'rejected' sai do quadro). Se o quadro não conhecer o
+        pedido (ou ele estiver em outro status), marca para recarregar.
+        """
+        with self._lock:
+            self._mutations += 1
+            if self._state is None or self._stale:
+                return
+            state = self._state
+            order = state.orders.get(order_id)
+            if order is None or (expected_from and order.status != expected_from):
+                self._stale = True
+                return
+            state.queues[order.status].remove(order)
+            if status in state.queues:
+                order.status = status
+                self._insert(state.queues[status], order)
+                return
+            del state.orders[order_id]
+            if status == 'completed':
+                state.called.appendleft((order.id, order.order_number, order.customer_name))
+
+    @staticmethod
+    def _insert(queue, order):
+        keys = [o.key for o in queue]
+        queue.insert(bisect.bisect_right(keys, order.key), order)
+
+    # --- Leituras das telas ---
+
+    def next_ready(self):
+        """O pedido pronto mais antigo (candidato para o gerente chamar), ou None."""
+        self._refresh()
+        with self._lock:
+            ready = self._state.queues['ready']
+            return ready[0] if ready else None
+
+    def ready_count(self):
+        self._refresh()
+        with self._lock:
+            return len(self._state.queues['ready'])
+
+    def status_view(self):
+        """Corpo de /api/orders/status."""
+        self._refresh()
+        with self._lock:
+            state = self._state
+            return {
+                status: [{
+                    "order_number": o.order_number,
+                    "customer_name": o.customer_name,
+                    "items": [f"{quantity}x {name}" for name, quantity in o.items],
+                    "status": o.status,
+                } for o in state.queues[status]]
+                for status in ('preparing', 'ready')
+            }
+
+    def kitchen_view(self):
+        """Corpo de /api/kitchen/orders."""
+        self._refresh()
+        with self._lock:
+            return [{
+                "id": o.id,
+                "order_number": o.order_number,
+                "customer_name": o.customer_name,
+                "items": [name for name, _ in o.items],
+                "quantities": [quantity for _, quantity in o.items],
+            } for o in self._state.queues['preparing']]
+
+    def monitor_view(self):
+        """Corpo de /api/monitor/orders (em preparo + prontos na ordem de chegada, e as últimas chamadas)."""
+        self._refresh()
+        with self._lock:
+            state = self._state
+            live = sorted(state.queues['preparing'] + state.queues['ready'], key=lambda o: o.key)
+            return {
+                "preparing": [{"order": o.order_number, "name": o.customer_name, "status": o.status} for o in live],
+                "ready": [{"order": number, "name": name} for _, number, name in state.called],
+            }
+
+    def stats(self):
+        with self._lock:
+            state = self._state
+            counts = {status: len(state.queues[status]) for status in LIVE_STATUSES} if state else {}
+            return {
+                "loaded": state is not None,
+                "stale": self._stale,
+                "loaded_seconds_ago": round(time.monotonic() - self._loaded_at, 3) if state else None,
+                "resync_seconds": RESYNC_SECONDS,
+                **{f"{status}_count": count for status, count in counts.items()},
+            }
+
+
+# Instância única usada pelo app
+board = OrderBoard()
@@ -0,0 +1,212 @@
+# changes.py
+# Barramento de mudanças entre processos (workers do gunicorn).
+#
+# Os caches em memória (cardápio, quadro de pedidos, respostas das telas) e os
+# eventos SSE só enxergavam as mudanças feitas no próprio processo. Agora toda
+# rota que altera estoque ou pedidos grava uma linha em change_log NA MESMA
+# transação da alteração (se a transação for desfeita, a mudança também some).
+# Cada processo tem uma thread que acompanha a tabela:
+#   - PRAGMA data_version diz, sem ler a tabela, se outra conexão fez commit;
+#   - só então lê as linhas novas (version > última vista), em ordem;
+#   - cada mudança é entregue uma única vez aos assinantes (subscribe), na
+#     ordem da versão, que é a mesma em todos os processos.
+# Depois do commit, a rota chama bus.wake() para a entrega local ser imediata;
+# as mudanças de outros processos chegam em até POLL_INTERVAL_MS.
+#
+# O armazenamento é plugável (BACKENDS / CHANGE_BUS_BACKEND). Hoje existe só
+# o "sqlite", que não precisa de nenhum serviço extra.
+
+import json
+import os
+import threading
+import time
+import uuid
+
+import db
+
+BACKEND_NAME = os.environ.get('CHANGE_BUS_BACKEND', 'sqlite')
+
+# Intervalo (ms) entre as verificações de mudanças feitas por outros processos
+POLL_INTERVAL_MS = float(os.environ.get('CHANGE_BUS_POLL_MS', '20'))
+
+# Por quanto tempo (segundos) as mudanças ficam guardadas em change_log
+RETENTION_SECONDS = int(os.environ.get('CHANGE_BUS_RETENTION_SECONDS', '86400'))
+
+# Intervalo (segundos) entre as limpezas das mudanças antigas
+_PRUNE_INTERVAL_SECONDS = 600
+
+
+class SQLiteBackend:
+    """Mudanças guardadas na tabela change_log do próprio banco."""
+
+    CREATE_TABLE = '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT, -- nunca é reaproveitada
+            topic TEXT NOT NULL,       -- 'orders' ou 'stock'
+            event TEXT NOT NULL,       -- ex: 'order_created', 'menu_changed'
+            data TEXT NOT NULL,        -- JSON
+            origin TEXT NOT NULL,      -- processo que fez a mudança
+            created_at REAL NOT NULL   -- time.time()
+        )
+    '''
+
+    def create_tables(self, cursor):
+        cursor.execute(self.CREATE_TABLE)
+
+    def append(self, cursor, topic, event, data, origin):
+        # Usa a conexão do cursor (não o próprio cursor) para não alterar o rowcount de quem chamou
+        cursor.connection.execute(
+            "INSERT INTO change_log (topic, event, data, origin, created_at) VALUES (?, ?, ?, ?, ?)",
+            (topic, event, json.dumps(data, ensure_ascii=False), origin, time.time()))
+
+    def open(self):
+        # Conexão própria da thread: data_version é por conexão
+        return db.connect()
+
+    def current_version(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+
+    def changed(self, conn, state):
+        """Retorna (mudou?, novo estado) comparando o PRAGMA data_version."""
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        return data_version != state, data_version
+
+    def read_after(self, conn, version):
+        rows = conn.execute(
+            "SELECT version, topic, event, data, origin FROM change_log WHERE version > ? ORDER BY version",
+            (version,)).fetchall()
+        return [{"version": v, "topic": t, "event": e, "data": json.loads(d), "origin": o}
+                for v, t, e, d, o in rows]
+
+    def prune(self, conn, older_than):
+        conn.execute("DELETE FROM change_log WHERE created_at < ?", (older_than,))
+        conn.commit()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+}
+
+
+class ChangeBus:
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscribers = []
+        self._start_callbacks = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._pid = None
+        self._origin = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._last_version = 0
+        self._started = threading.Event()
+
+    @property
+    def origin(self):
+        """Identificador deste processo (muda depois de um fork)."""
+        if self._pid != os.getpid() or self._origin is None:
+            self._origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._pid = os.getpid()
+        return self._origin
+
+    @property
+    def last_version(self):
+        return self._last_version
+
+    def subscribe(self, callback):
+        """callback(change) recebe dicts com version, topic, event, data e origin."""
+        self._subscribers.append(callback)
+
+    def on_start(self, callback):
+        """
+        callback(versão) é chamado quando a thread lê a versão inicial: uma vez
+        por processo (de novo só se a thread precisar ser reiniciada).
+        """
+        self._start_callbacks.append(callback)
+
+    def record(self, cursor, topic, event, **data):
+        """Registra uma mudança DENTRO da transação que a causou (antes do commit)."""
+        # A thread precisa ter lido a versão inicial ANTES deste commit, senão a mudança não é entregue
+        self.ensure_started()
+        self.backend.append(cursor, topic, event, data, self.origin)
+
+    def wake(self):
+        """Chamar depois do commit: entrega as mudanças deste processo sem esperar o próximo ciclo."""
+        self.ensure_started()
+        self._wake.set()
+
+    def ensure_started(self):
+        # A thread não sobrevive a um fork (gunicorn): cada worker inicia a sua
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._stopping = False
+                self._started = threading.Event()
+                self._thread_pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='change-bus', daemon=True)
+                self._thread.start()
+        # Só volta depois de saber a versão inicial (nada gravado depois disso se perde)
+        self._started.wait(5)
+
+    def stop(self, timeout=5):
+        if self._thread is None or self._thread_pid != os.getpid():
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = self.backend.open()
+        try:
+            # Começa da versão atual: o que aconteceu antes deste processo subir não é reenviado
+            self._last_version = self.backend.current_version(conn)
+            _, state = self.backend.changed(conn, None)
+            for callback in self._start_callbacks:
+                try:
+                    callback(self._last_version)
+                except Exception as e:
+                    print(f"Erro ao iniciar o barramento de mudanças: {e}")
+            self._started.set()
+            last_prune = time.monotonic()
+            while not self._stopping:
+                self._wake.wait(POLL_INTERVAL_MS / 1000)
+                self._wake.clear()
+                try:
+                    changed, state = self.backend.changed(conn, state)
+                    if changed:
+                        self._deliver(self.backend.read_after(conn, self._last_version))
+                    if time.monotonic() - last_prune > _PRUNE_INTERVAL_SECONDS:
+                        last_prune = time.monotonic()
+                        self.backend.prune(conn, time.time() - RETENTION_SECONDS)
+                except Exception as e:
+                    print(f"Erro ao ler o barramento de mudanças: {e}")
+                    time.sleep(1)
+        finally:
+            self._started.set()
+            conn.close()
+
+    def _deliver(self, changes):
+        for change in changes:
+            # Cada versão é entregue uma única vez, em ordem
+            if change["version"] <= self._last_version:
+                continue
+            self._last_version = change["version"]
+            for callback in self._subscribers:
+                try:
+                    callback(change)
+                except Exception as e:
+                    print(f"Erro ao aplicar a mudança {change['version']} ({change['event']}): {e}")
+
+
+def _create_backend(name):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"CHANGE_BUS_BACKEND inválido: '{name}'. Opções: {', '.join(BACKENDS)}")
+
+
+# Instância única usada pelo app
+bus = ChangeBus(_create_backend(BACKEND_NAME))
@@ -0,0 +1,260 @@
+# db.py
+# Camada única de acesso ao SQLite usada por todas as rotas do app.py.
+#
+# - Mantém um pool de conexões reutilizáveis (por processo/worker), evitando
+#   o custo de abrir e fechar o arquivo a cada requisição.
+# - Liga o modo WAL e ajusta os PRAGMAs para que leitores (monitor, cozinha)
+#   nunca bloqueiem quem grava pedidos.
+# - Expõe contadores de tempo para acompanhar o uso do pool.
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+DB_PATH = os.environ.get('TORTAS_DB_PATH', 'database.db')
+
+# Quantidade máxima de conexões ociosas guardadas no pool
+POOL_SIZE = int(os.environ.get('TORTAS_DB_POOL_SIZE', '8'))
+
+# Tempo (em ms) que uma conexão espera por um lock antes de dar "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('TORTAS_DB_BUSY_TIMEOUT_MS', '5000'))
+
+# PRAGMAs aplicados em toda conexão nova.
+# synchronous=NORMAL é seguro em WAL (só perde o último commit em queda de energia).
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB de cache de páginas por conexão
+    "PRAGMA mmap_size = 268435456",    # 256 MB de leitura via mmap
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",        # order_items depende de orders/stock
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+# PRAGMAs das conexões somente leitura (sem os que alteram o arquivo)
+READONLY_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "connections_opened": 0,
+    "connections_closed": 0,
+    "checkouts": 0,
+    "reuses": 0,
+    "checkout_seconds_total": 0.0,
+    "hold_seconds_total": 0.0,
+    "hold_seconds_max": 0.0,
+}
+
+
+def _bump(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexão do pool; guarda o instante em que foi retirada para medir o uso."""
+    _checked_out_at = 0.0
+
+
+# Função chamada com (sql, segundos) após cada comando, quando a medição está ligada.
+# Definida por set_statement_observer(); com None, as conexões não têm custo extra.
+_statement_observer = None
+
+
+def set_statement_observer(observer):
+    """
+    Liga (ou desliga, com None) a medição de tempo de cada comando SQL.
+    Vale para as conexões abertas a partir de agora, por isso deve ser
+    chamada na inicialização, antes do primeiro acesso ao banco.
+    """
+    global _statement_observer
+    _statement_observer = observer
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observer = _statement_observer
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observer = _statement_observer
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+
+
+class TimedConnection(PooledConnection):
+    """Conexão usada quando a medição está ligada: todo comando passa pelo TimedCursor."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect():
+    """
+    Abre uma conexão FORA do pool, com os mesmos PRAGMAs, para threads de
+    longa duração (ex: changes.py). Quem abre é responsável por fechar.
+    """
+    return _open_connection()
+
+
+def connect_readonly(path=None):
+    """
+    Abre uma conexão SOMENTE LEITURA (mode=ro), fora do pool, ao banco em path
+    (padrão: o banco principal). Usada pelos relatórios (reporting.py).
+    """
+    factory = TimedConnection if _statement_observer is not None else PooledConnection
+    uri = f"file:{urllib.parse.quote(os.path.abspath(path or DB_PATH))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, factory=factory)
+    for pragma in READONLY_PRAGMAS:
+        conn.execute(pragma)
+    _bump(connections_opened=1)
+    return conn
+
+
+def _open_connection():
+    factory = TimedConnection if _statement_observer is not None else PooledConnection
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, factory=factory)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _bump(connections_opened=1)
+    return conn
+
+
+def _reset_after_fork():
+    """
+    Depois de um fork (gunicorn, multiprocessing), as conexões herdadas do
+    processo pai não podem ser usadas. Descarta o pool e começa um novo.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+            _pool_pid = os.getpid()
+
+
+def get_connection():
+    """
+    Retira uma conexão do pool (ou abre uma nova se o pool estiver vazio).
+    Toda conexão obtida aqui deve ser devolvida com release_connection().
+    """
+    if _pool_pid != os.getpid():
+        _reset_after_fork()
+
+    started = time.perf_counter()
+    try:
+        conn = _pool.get_nowait()
+        reused = 1
+    except queue.Empty:
+        conn = _open_connection()
+        reused = 0
+    now = time.perf_counter()
+    conn._checked_out_at = now
+    _bump(checkouts=1, reuses=reused, checkout_seconds_total=now - started)
+    return conn
+
+
+def release_connection(conn):
+    """
+    Devolve a conexão ao pool. Se ainda houver uma transação aberta
+    (ex: a rota retornou antes do commit), ela é desfeita antes.
+    """
+    if conn is None:
+        return
+    held = time.perf_counter() - conn._checked_out_at
+    with _stats_lock:
+        _stats["hold_seconds_total"] += held
+        _stats["hold_seconds_max"] = max(_stats["hold_seconds_max"], held)
+
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        # Conexão quebrada: não volta para o pool
+        _close(conn)
+        return
+
+    if _pool_pid != os.getpid():
+        _close(conn)
+        return
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        _close(conn)
+
+
+def _close(conn):
+    try:
+        conn.close()
+    finally:
+        _bump(connections_closed=1)
+
+
+def close_all():
+    """Fecha todas as conexões ociosas do pool (usado no desligamento)."""
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        _close(conn)
+
+
+def stats():
+    """Retorna uma cópia dos contadores do pool, com médias já calculadas."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    checkouts = snapshot["checkouts"] or 1
+    snapshot["checkout_ms_avg"] = round(snapshot["checkout_seconds_total"] * 1000 / checkouts, 4)
+    snapshot["hold_ms_avg"] = round(snapshot["hold_seconds_total"] * 1000 / checkouts, 4)
+    snapshot["idle_connections"] = _pool.qsize()
+    snapshot["pool_size"] = POOL_SIZE
+    return snapshot
+
+
+def find_full_scans(conn, statements):
+    """
+    Roda EXPLAIN QUERY PLAN em cada consulta e devolve as que fazem
+    varredura completa de tabela (SCAN sem índice) ou ordenam o resultado
+    em uma tabela temporária (USE TEMP B-TREE).
+
+    statements: lista de (nome, sql, parâmetros)
+    Retorna: lista de (nome, detalhe do plano)
+    """
+    problems = []
+    for name, sql, params in statements:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if (detail.startswith("SCAN ") and "INDEX" not in detail) or "TEMP B-TREE" in detail:
+                problems.append((name, detail))
+    return problems
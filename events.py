@@ -0,0 +1,220 @@
+# events.py
+# Canal de eventos do ciclo de vida dos pedidos (criado, pagamento aprovado,
+# recusado, pronto, chamado...), entregue às telas via Server-Sent Events.
+#
+# Os eventos chegam pelo barramento de mudanças (changes.py), com a versão
+# global como id, então todos os workers numeram os eventos da mesma forma.
+# Cada tela conectada em /api/events recebe os eventos na ordem, e um cliente
+# que reconecta informa o último id recebido (cabeçalho Last-Event-ID) para
+# continuar de onde parou.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Quantos eventos recentes ficam guardados para permitir a retomada
+HISTORY_SIZE = int(os.environ.get('EVENTS_HISTORY_SIZE', '500'))
+
+# Intervalo (em segundos) do comentário de keep-alive enviado a conexões ociosas
+HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+
+
+class EventBroker:
+    """
+    Guarda os últimos eventos em um buffer circular e acorda as conexões
+    SSE que estão esperando quando um novo evento é publicado.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._history = deque(maxlen=history_size)
+        self._condition = threading.Condition()
+        self._last_id = 0
+        # Maior id que o histórico não cobre mais (saiu do buffer ou é anterior ao início)
+        self._floor = 0
+        self._closed = False
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event_type, data, event_id=None):
+        """
+        Registra um evento e acorda todas as conexões em espera. event_id é a
+        versão do barramento de mudanças (changes.py), igual em todos os
+        processos; sem ela, o id é o próximo número local.
+        """
+        with self._condition:
+            self._last_id = event_id if event_id is not None else self._last_id + 1
+            if len(self._history) == self._history.maxlen:
+                self._floor = self._history[0]["id"]
+            event = {"id": self._last_id, "type": event_type, "data": data, "ts": time.time()}
+            self._history.append(event)
+            self._condition.notify_all()
+        return event
+
+    def advance_to(self, event_id):
+        """
+        Pula o contador para event_id sem criar evento (início do barramento de
+        mudanças). Os ids pulados não estão no histórico: quem parou antes
+        deles precisa recarregar a tela.
+        """
+        with self._condition:
+            self._last_id = max(self._last_id, event_id)
+            self._floor = max(self._floor, event_id)
+
+    def skip(self, event_id):
+        """
+        Registra uma versão do barramento que não vira evento SSE (mudanças do
+        estoque). O id é conhecido e não deixa buraco na sequência.
+        """
+        with self._condition:
+            self._last_id = max(self._last_id, event_id)
+
+    def events_after(self, last_id):
+        """
+        Retorna (eventos, completo). 'completo' é False quando o cliente ficou
+        tanto tempo fora que parte dos eventos já saiu do buffer (ou parou
+        antes do início do servidor).
+        """
+        with self._condition:
+            return self._events_after(last_id)
+
+    def _events_after(self, last_id):
+        if last_id > self._last_id:
+            # Id de uma execução anterior do servidor (o contador recomeçou)
+            return [], False
+        if last_id == self._last_id:
+            return [], True
+        events = [e for e in self._history if e["id"] > last_id]
+        # Os ids entre os eventos podem ter buracos (versões puladas com skip);
+        # só falta algo se o cliente parou antes do que o histórico cobre
+        return events, last_id >= self._floor
+
+    def wait(self, last_id, timeout):
+        """Bloqueia até surgir um evento depois de last_id (ou até o timeout)."""
+        with self._condition:
+            events, complete = self._events_after(last_id)
+            if not events and complete and not self._closed:
+                self._condition.wait(timeout)
+                events, complete = self._events_after(last_id)
+            return events, complete
+
+    def close(self):
+        """Acorda e encerra todas as conexões (desligamento do servidor)."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stream(self, last_id=None):
+        """
+        Gerador de mensagens no formato text/event-stream.
+        Se last_id for None, começa a partir do evento atual (sem histórico).
+        """
+        if last_id is None:
+            last_id = self._last_id
+
+        # Diz ao navegador para tentar reconectar em 3s caso a conexão caia
+        yield "retry: 3000\n\n"
+
+        events, complete = self.events_after(last_id)
+        if not complete:
+            # O histórico não cobre o que o cliente perdeu: ele deve recarregar a tela inteira
+            yield format_sse("resync", {"last_id": self._last_id}, self._last_id)
+            events = []
+            last_id = self._last_id
+
+        while not self._closed:
+            for event in events:
+                yield format_sse(event["type"], event["data"], event["id"])
+                last_id = event["id"]
+
+            events, complete = self.wait(last_id, HEARTBEAT_SECONDS)
+            if not events and complete:
+                yield ": keep-alive\n\n"
+            elif not complete:
+                yield format_sse("resync", {"last_id": self._last_id}, self._last_id)
+                events = []
+                last_id = self._last_id
+
+
+class OrderStatusWaiters:
+    """
+    Espera pela mudança de status de UM pedido (long-poll do cliente no PIX).
+    Cada requisição em espera registra um waiter para o id do pedido; a
+    publicação de um evento com order_id e status acorda só os waiters desse
+    pedido, entregando o novo status sem consultar o banco de novo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}  # order_id -> lista de waiters
+        self._closed = False
+
+    def register(self, order_id):
+        """Registra a espera ANTES de ler o status no banco (assim nenhuma mudança se perde)."""
+        waiter = _StatusWaiter()
+        with self._lock:
+            if self._closed:
+                waiter.event.set()
+            else:
+                self._waiters.setdefault(order_id, []).append(waiter)
+        return waiter
+
+    def unregister(self, order_id, waiter):
+        with self._lock:
+            waiters = self._waiters.get(order_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[order_id]
+
+    def notify(self, order_id, status):
+        with self._lock:
+            waiters = self._waiters.pop(order_id, ())
+        for waiter in waiters:
+            waiter.status = status
+            waiter.event.set()
+
+    def close(self):
+        """Acorda todas as esperas (desligamento do servidor)."""
+        with self._lock:
+            self._closed = True
+            waiters = [w for ws in self._waiters.values() for w in ws]
+            self._waiters.clear()
+        for waiter in waiters:
+            waiter.event.set()
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(ws) for ws in self._waiters.values())
+
+
+class _StatusWaiter:
+    __slots__ = ('event', 'status')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None
+
+
+def format_sse(event_type, data, event_id):
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+
+# Instâncias únicas usadas pelo app
+broker = EventBroker()
+order_status = OrderStatusWaiters()
+
+
+def publish(event_type, event_id=None, **data):
+    event = broker.publish(event_type, data, event_id)
+    if 'order_id' in data and 'status' in data:
+        order_status.notify(data['order_id'], data['status'])
+    return event
@@ -0,0 +1,57 @@
+# gunicorn.conf.py
+# Configuração do servidor de produção (gunicorn -c gunicorn.conf.py wsgi:app).
+#
+# As telas (cozinha, monitor, status do cliente) mantêm conexões abertas por
+# muito tempo (/api/events). Com o worker "gevent" cada conexão é uma greenlet
+# e não ocupa um worker inteiro; sem o gevent instalado cai para "gthread",
+# onde cada conexão ocupa uma thread (aumente GUNICORN_THREADS).
+#
+# Variáveis de ambiente:
+#   PORT / GUNICORN_BIND        endereço (padrão 0.0.0.0:5000)
+#   WEB_CONCURRENCY             número de processos (padrão 2)
+#   GUNICORN_WORKER_CLASS       força "gevent", "gthread" ou "sync"
+#   GUNICORN_THREADS            threads por processo no gthread (padrão 32)
+#   GUNICORN_WORKER_CONNECTIONS conexões simultâneas por processo no gevent (padrão 1000)
+#   GUNICORN_GRACEFUL_TIMEOUT   segundos para terminar as requisições ao desligar (padrão 15)
+
+import os
+import subprocess
+import sys
+
+try:
+    import gevent  # noqa: F401
+    _default_worker_class = 'gevent'
+except ImportError:
+    _default_worker_class = 'gthread'
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', _default_worker_class)
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# Os streams mandam ": keep-alive" a cada poucos segundos, então o timeout
+# só derruba workers realmente travados
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '15'))
+keepalive = 5
+
+# O app NÃO é carregado no processo principal: com o gevent, objetos de
+# threading criados antes do fork (pool, broker de eventos) não seriam
+# cooperativos dentro dos workers.
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    # Prepara o banco uma única vez, num processo separado, antes de criar os workers
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], check=True)
+    os.environ['TORTAS_DB_INITIALIZED'] = '1'
+
+
+def worker_exit(server, worker):
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.shutdown()
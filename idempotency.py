@@ -0,0 +1,86 @@
+# idempotency.py
+# Chaves de idempotência do POST /api/orders (cabeçalho Idempotency-Key).
+#
+# Quando o checkout demora, o cliente toca "finalizar" de novo ou o celular
+# reenvia a requisição. Com a mesma chave, a segunda tentativa recebe a
+# resposta original em vez de criar outro pedido. A chave é gravada na MESMA
+# transação do pedido, então ou os dois existem ou nenhum existe.
+# Junto com a chave fica o hash do corpo da requisição: um reenvio com a mesma
+# chave e outro carrinho é recusado em vez de receber o primeiro pedido.
+
+import hashlib
+import json
+import os
+import time
+
+# Por quanto tempo (segundos) uma chave continua válida
+TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '3600'))
+
+# Tamanho máximo aceito para a chave enviada pelo cliente
+MAX_KEY_LENGTH = 255
+
+CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        status_code INTEGER NOT NULL,
+        body TEXT NOT NULL,
+        request_hash TEXT NOT NULL, -- sha256 do corpo da requisição (ver request_hash)
+        created_at REAL NOT NULL -- time.time() da gravação
+    )
+'''
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at)"
+
+# As chaves vencidas são apagadas no máximo uma vez por minuto
+_PURGE_INTERVAL_SECONDS = 60
+_last_purge = 0.0
+
+
+def request_hash(data):
+    """Hash do corpo JSON da requisição (independe da ordem das chaves e dos espaços)."""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def lookup(cursor, key):
+    """Retorna (status_code, corpo, request_hash) da resposta guardada para a chave, ou None."""
+    cursor.execute(
+        "SELECT status_code, body, request_hash FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+        (key, time.time() - TTL_SECONDS))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0], json.loads(row[1]), row[2]
+
+
+class KeyInUse(Exception):
+    """Outra requisição com a mesma chave já gravou (ou está gravando) o pedido."""
+
+
+def remember(cursor, key, status_code, body, body_hash):
+    """
+    Guarda a resposta da chave e o hash do corpo da requisição (chamar dentro
+    da transação do pedido).
+    Lança KeyInUse se a chave já tiver uma resposta válida; quem chama deve
+    desfazer o pedido e devolver a resposta guardada.
+    """
+    _purge_expired(cursor)
+    now = time.time()
+    # Uma chave vencida que ainda não foi apagada pode ser reaproveitada
+    cursor.execute('''
+        INSERT INTO idempotency_keys (key, status_code, body, request_hash, created_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            status_code = excluded.status_code, body = excluded.body,
+            request_hash = excluded.request_hash, created_at = excluded.created_at
+        WHERE idempotency_keys.created_at < ?
+    ''', (key, status_code, json.dumps(body, ensure_ascii=False), body_hash, now, now - TTL_SECONDS))
+    if cursor.rowcount == 0:
+        raise KeyInUse(key)
+
+
+def _purge_expired(cursor):
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < _PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - TTL_SECONDS,))
@@ -0,0 +1,135 @@
+# images.py
+# Processamento das fotos enviadas no cadastro de itens do estoque.
+#
+# As fotos vêm do celular (5–10 MB) e eram servidas em tamanho original para
+# cada cliente. Agora cada upload gera versões reduzidas em WebP e JPEG
+# (miniatura, média e grande), todas nomeadas pelo hash do conteúdo:
+#   <hash>.<ext>            original
+#   <hash>-<versão>.webp    versão reduzida em WebP
+#   <hash>-<versão>.jpg     versão reduzida em JPEG (navegadores sem WebP)
+# Como o nome muda sempre que o conteúdo muda, os arquivos podem ser guardados
+# pelo navegador "para sempre" (Cache-Control immutable), e dois uploads com o
+# mesmo nome de arquivo não se sobrescrevem mais.
+#
+# O Pillow é opcional: sem ele, só o original é gravado (já com nome por hash).
+
+import hashlib
+import io
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Largura máxima (px) de cada versão
+VARIANTS = {
+    'thumb': 320,
+    'medium': 800,
+    'large': 1600,
+}
+
+# Versão usada no image_path (campo que as telas já usam)
+DEFAULT_VARIANT = 'medium'
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'gif'}
+
+# Nomes gerados por este módulo (podem ser servidos com cache imutável)
+HASHED_NAME = re.compile(r'^[0-9a-f]{16}(-[a-z]+)?\.[a-z0-9]+$')
+
+
+class InvalidImage(Exception):
+    """O arquivo enviado não é uma imagem aceita."""
+
+
+def is_hashed_name(filename):
+    return bool(HASHED_NAME.match(filename))
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if ext not in ALLOWED_EXTENSIONS:
+        raise InvalidImage(f"Formato de imagem não aceito: '{ext or filename}'.")
+    return 'jpg' if ext == 'jpeg' else ext
+
+
+def _write_once(folder, filename, data):
+    """Grava o arquivo só se ainda não existir (mesmo hash = mesmo conteúdo)."""
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def process_upload(data, filename, folder, url_for_file):
+    """
+    Grava o original e as versões reduzidas de uma imagem enviada.
+
+    data: bytes do arquivo; filename: nome original (só a extensão é usada);
+    url_for_file: função que recebe o nome gravado e devolve a URL pública.
+    Retorna (image_path, variants): a URL da versão padrão (ou do original,
+    sem Pillow) e o dict {versão: {"width", "height", "webp", "jpeg"}}.
+    Lança InvalidImage se o arquivo não for uma imagem válida.
+    """
+    ext = _extension(filename)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    original_name = f"{digest}.{ext}"
+
+    if Image is None:
+        _write_once(folder, original_name, data)
+        return url_for_file(original_name), {}
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source.load()
+            # Fotos de celular vêm "deitadas" com a rotação na EXIF
+            image = ImageOps.exif_transpose(source)
+    except Exception as e:
+        raise InvalidImage(f"Arquivo de imagem inválido: {e}")
+
+    _write_once(folder, original_name, data)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    rgba = image.convert('RGBA') if has_alpha else image.convert('RGB')
+    if has_alpha:
+        # JPEG não tem transparência: aplica fundo branco
+        rgb = Image.new('RGB', rgba.size, (255, 255, 255))
+        rgb.paste(rgba, mask=rgba.getchannel('A'))
+    else:
+        rgb = rgba
+
+    variants = {}
+    for name, max_width in VARIANTS.items():
+        width, height = rgba.size
+        if width > max_width:
+            height = max(1, round(height * max_width / width))
+            width = max_width
+        webp_name = f"{digest}-{name}.webp"
+        jpeg_name = f"{digest}-{name}.jpg"
+        if not os.path.exists(os.path.join(folder, webp_name)):
+            _write_once(folder, webp_name, _encode(rgba.resize((width, height), Image.LANCZOS), 'WEBP', WEBP_QUALITY))
+        if not os.path.exists(os.path.join(folder, jpeg_name)):
+            _write_once(folder, jpeg_name, _encode(rgb.resize((width, height), Image.LANCZOS), 'JPEG', JPEG_QUALITY))
+        variants[name] = {
+            "width": width,
+            "height": height,
+            "webp": url_for_file(webp_name),
+            "jpeg": url_for_file(jpeg_name),
+        }
+
+    return variants[DEFAULT_VARIANT]["jpeg"], variants
@@ -0,0 +1,172 @@
+# ingest.py
+# Fila de gravação de pedidos com "group commit" para os picos de movimento.
+#
+# Com ORDER_GROUP_COMMIT=1, a rota /api/orders não grava o pedido sozinha:
+# entrega o pedido já validado para uma thread gravadora, que junta os pedidos
+# que chegam dentro de alguns milissegundos e grava todos em UMA transação
+# (um único commit/fsync). Cada pedido roda em seu próprio SAVEPOINT, então a
+# falta de estoque em um pedido não desfaz os outros, e cada requisição recebe
+# o seu próprio resultado (ou erro).
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+from orders import place_order
+
+GROUP_COMMIT_ENABLED = os.environ.get('ORDER_GROUP_COMMIT', '0') == '1'
+
+# Máximo de pedidos gravados por transação
+BATCH_SIZE = int(os.environ.get('ORDER_BATCH_SIZE', '50'))
+
+# Quanto tempo (ms) a gravadora espera por mais pedidos depois do primeiro do lote
+BATCH_WINDOW_MS = float(os.environ.get('ORDER_BATCH_WINDOW_MS', '5'))
+
+# Quanto tempo (s) a rota espera pelo resultado antes de desistir do pedido
+SUBMIT_TIMEOUT_SECONDS = float(os.environ.get('ORDER_SUBMIT_TIMEOUT_SECONDS', '30'))
+
+
+class OrderWriter:
+    def __init__(self, batch_size=BATCH_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "orders": 0,
+            "failed_orders": 0,
+            "batch_size_max": 0,
+            "commit_seconds_total": 0.0,
+            "commit_seconds_max": 0.0,
+            "commit_seconds_last": 0.0,
+        }
+
+    def _ensure_started(self):
+        # A thread não sobrevive a um fork (gunicorn): cada worker inicia a sua
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, order):
+        """
+        Entrega um pedido validado para gravação. Retorna um Future com o resultado.
+        future.cancel() só funciona enquanto a gravadora não pegou o pedido; depois
+        de cancelado, ele nunca é gravado.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((order, future))
+        return future
+
+    def stop(self, timeout=5):
+        """Grava o que já está na fila e encerra a thread (desligamento do servidor)."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._stopping = True
+                    break
+                batch.append(entry)
+
+            self._write_batch(batch)
+            if self._stopping and self._queue.empty():
+                break
+
+    def _write_batch(self, batch):
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        results = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for order, future in batch:
+                # A rota pode ter desistido de esperar (cancel): o pedido não é gravado
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute("SAVEPOINT order_entry")
+                try:
+                    results.append((future, place_order(cursor, order), None))
+                    cursor.execute("RELEASE order_entry")
+                except Exception as e:
+                    # Desfaz só este pedido; os outros do lote continuam
+                    cursor.execute("ROLLBACK TO order_entry")
+                    cursor.execute("RELEASE order_entry")
+                    results.append((future, None, e))
+
+            started = time.perf_counter()
+            conn.commit()
+            self._record(len(results), time.perf_counter() - started, sum(1 for r in results if r[2]))
+        except Exception as e:
+            # A transação inteira falhou: todos os pedidos do lote recebem o erro
+            conn.rollback()
+            print(f"Erro ao gravar lote de pedidos: {e}")
+            for order, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            db.release_connection(conn)
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _record(self, size, commit_seconds, failed):
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["orders"] += size
+            self._stats["failed_orders"] += failed
+            self._stats["batch_size_max"] = max(self._stats["batch_size_max"], size)
+            self._stats["commit_seconds_total"] += commit_seconds
+            self._stats["commit_seconds_max"] = max(self._stats["commit_seconds_max"], commit_seconds)
+            self._stats["commit_seconds_last"] = commit_seconds
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        batches = snapshot["batches"] or 1
+        snapshot["enabled"] = GROUP_COMMIT_ENABLED
+        snapshot["batch_size"] = self.batch_size
+        snapshot["batch_window_ms"] = self.window * 1000
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["batch_size_avg"] = round(snapshot["orders"] / batches, 2)
+        snapshot["commit_ms_avg"] = round(snapshot["commit_seconds_total"] * 1000 / batches, 4)
+        return snapshot
+
+
+# Instância única usada pelo app
+writer = OrderWriter()
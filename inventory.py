@@ -0,0 +1,90 @@
+# inventory.py
+# Conferência e baixa de estoque do carrinho inteiro em poucas idas ao banco.
+#
+# Antes era um SELECT/UPDATE por linha do carrinho, e a baixa não conferia se
+# o estoque continuava positivo (dois carrinhos ao mesmo tempo podiam vender
+# o mesmo item duas vezes). Aqui a baixa é um único UPDATE condicionado a
+# "quantity >= pedido", feito dentro da transação BEGIN IMMEDIATE do pedido.
+
+
+def aggregate_cart(items):
+    """
+    Soma as quantidades por id do estoque (o mesmo item pode aparecer em mais
+    de uma linha do carrinho). Mantém a ordem em que os itens apareceram.
+    Retorna {id: {"quantity": total, "name": nome no carrinho}}.
+    Lança ValueError se alguma quantidade não for um inteiro positivo.
+    """
+    cart = {}
+    for item in items:
+        item_id = int(item['id'])
+        quantity = int(item['quantity'])
+        if quantity <= 0:
+            raise ValueError(f"Quantidade inválida para o item ID {item_id}.")
+        if item_id in cart:
+            cart[item_id]["quantity"] += quantity
+        else:
+            cart[item_id] = {"quantity": quantity, "name": item.get('name', 'Item removido')}
+    return cart
+
+
+def find_unavailable(cursor, cart):
+    """
+    Confere o carrinho inteiro com um único SELECT ... WHERE id IN (...).
+    Retorna a lista de itens sem estoque suficiente, no mesmo formato
+    usado pela rota /api/stock/check.
+    """
+    if not cart:
+        return []
+    placeholders = ",".join("?" * len(cart))
+    cursor.execute(f"SELECT id, name, quantity FROM stock WHERE id IN ({placeholders})", list(cart))
+    in_stock = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    unavailable_items = []
+    for item_id, wanted in cart.items():
+        stock_item = in_stock.get(item_id)
+        # 1. Item NÃO FOI ENCONTRADO no banco de dados: usa o nome do carrinho
+        if not stock_item:
+            unavailable_items.append({
+                "id": item_id,
+                "name": wanted["name"],
+                "requested": wanted["quantity"],
+                "available": 0
+            })
+        # 2. FOI ENCONTRADO, mas não tem estoque suficiente: usa o nome do BD
+        elif stock_item[1] < wanted["quantity"]:
+            unavailable_items.append({
+                "id": item_id,
+                "name": stock_item[0],
+                "requested": wanted["quantity"],
+                "available": stock_item[1]
+            })
+    return unavailable_items
+
+
+def reserve(cursor, cart):
+    """
+    Confere e dá baixa no estoque do carrinho inteiro: um SELECT para validar
+    e um único UPDATE para todas as linhas. Deve rodar dentro de uma transação
+    já aberta com BEGIN IMMEDIATE (o lock de escrita garante que ninguém altera
+    o estoque entre a conferência e a baixa); o chamador confirma ou desfaz.
+
+    Retorna a lista de itens indisponíveis: vazia quando tudo foi reservado.
+    """
+    unavailable_items = find_unavailable(cursor, cart)
+    if unavailable_items or not cart:
+        return unavailable_items
+
+    values = ",".join(["(?, ?)"] * len(cart))
+    params = [value for item_id, wanted in cart.items() for value in (item_id, wanted["quantity"])]
+    # VALUES vira uma tabela temporária "cart" (column1 = id, column2 = quantidade).
+    # Fica no FROM, e não em um WITH, para o cursor.rowcount continuar funcionando.
+    cursor.execute(f'''
+        UPDATE stock SET quantity = stock.quantity - cart.column2
+        FROM (VALUES {values}) AS cart
+        WHERE stock.id = cart.column1 AND stock.quantity >= cart.column2
+    ''', params)
+
+    # Proteção extra: a condição quantity >= qty nunca deixa o estoque negativo
+    if cursor.rowcount != len(cart):
+        return find_unavailable(cursor, cart)
+    return []
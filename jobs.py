@@ -0,0 +1,299 @@
+# jobs.py
+# Tarefas pesadas do admin (exportação e análise de vendas) em segundo plano.
+#
+# A exportação com pandas/openpyxl prendia a thread da requisição e o GIL
+# enquanto as telas da cozinha e do monitor faziam polling. Agora o admin
+# cria um job e acompanha o andamento:
+#   POST /api/admin/jobs/<tipo>         -> 202 com o id do job
+#   GET  /api/admin/jobs/<id>           -> status e progresso
+#   GET  /api/admin/jobs/<id>/result    -> arquivo (ou JSON) pronto
+#
+# - Os jobs rodam em um pool de PROCESSOS (ProcessPoolExecutor), então o
+#   trabalho de CPU não disputa o GIL com as requisições.
+# - Os processos são criados com "spawn": o processo do app tem threads e
+#   conexões SQLite abertas, que não podem ser herdadas por um fork.
+# - O estado fica em arquivos (JOBS_DIR/<id>/job.json e progress.json), não
+#   na memória: qualquer worker do gunicorn responde pelo status de qualquer job.
+# - O resultado fica guardado por RESULT_TTL_SECONDS. Um pedido igual (mesmo
+#   tipo e parâmetros) nesse intervalo reaproveita o job existente.
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import reporting
+import sales
+import sales_export
+
+JOBS_DIR = os.environ.get('JOBS_DIR', 'jobs')
+
+# Processos do pool (cada um roda um job por vez)
+WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+
+# Por quanto tempo (segundos) o resultado de um job fica disponível
+RESULT_TTL_SECONDS = int(os.environ.get('JOB_RESULT_TTL_SECONDS', '600'))
+
+# Job que não termina nesse tempo (ex: o worker que o criou morreu) é dado como falho
+MAX_RUNTIME_SECONDS = int(os.environ.get('JOB_MAX_RUNTIME_SECONDS', '3600'))
+
+# Intervalo mínimo (segundos) entre gravações do progress.json
+_PROGRESS_INTERVAL = 0.25
+
+FINISHED = ('done', 'failed')
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobError(Exception):
+    """Tipo de job desconhecido ou parâmetros inválidos."""
+
+
+def _write_json(path, data):
+    # Grava em um arquivo temporário e troca de uma vez: quem lê nunca vê o arquivo pela metade
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class Progress:
+    """Progresso do job, gravado em progress.json pelo processo que o executa."""
+
+    def __init__(self, job_dir):
+        self.path = os.path.join(job_dir, 'progress.json')
+        self.done = 0
+        self.total = None
+        self.message = None
+        self._written_at = 0.0
+
+    def update(self, done=None, total=None, message=None, force=False):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        if force or time.monotonic() - self._written_at >= _PROGRESS_INTERVAL:
+            self._written_at = time.monotonic()
+            _write_json(self.path, {"done": self.done, "total": self.total, "message": self.message})
+
+    def advance(self, count):
+        self.update(done=self.done + count)
+
+
+# --- Tipos de job ---
+# Cada tipo tem validate(args) -> parâmetros normalizados (ou ValueError) e
+# run(params, job_dir, progress) -> dict com o resultado gravado em job_dir.
+
+def _check_dates(args):
+    for key in ('from', 'to'):
+        if args.get(key):
+            try:
+                datetime.strptime(args[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("Datas devem estar no formato AAAA-MM-DD.")
+    return {"from": args.get('from') or None, "to": args.get('to') or None}
+
+
+def _validate_export(args):
+    params = _check_dates(args)
+    params["format"] = (args.get('format') or 'xlsx').lower()
+    if params["format"] not in ('xlsx', 'csv'):
+        raise ValueError("Formato inválido. Use 'xlsx' ou 'csv'.")
+    statuses = args.get('status') or []
+    if isinstance(statuses, str):
+        statuses = [s for s in statuses.split(',') if s]
+    params["status"] = sorted(statuses)
+    return params
+
+
+def _run_export(params, job_dir, progress):
+    sql, sql_params = sales_export.build_query(params["from"], params["to"], params["status"])
+    conn = reporting.get_connection()
+    try:
+        data_as_of = reporting.as_of(conn)
+        total = sales_export.count_rows(sql, sql_params, conn)
+        progress.update(done=0, total=total, message="Exportando vendas", force=True)
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        filename = f"relatorio_vendas_{timestamp}.{params['format']}"
+        path = os.path.join(job_dir, filename)
+        if params["format"] == 'csv':
+            sales_export.write_csv(sql, sql_params, path, progress.advance, source=reporting, conn=conn)
+            mimetype = 'text/csv'
+        else:
+            sales_export.write_xlsx(sql, sql_params, path, progress.advance, source=reporting, conn=conn)
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    finally:
+        reporting.release_connection(conn)
+    return {"file": filename, "mimetype": mimetype, "data_as_of": data_as_of}
+
+
+def _run_analysis(params, job_dir, progress):
+    progress.update(done=0, total=1, message="Somando vendas", force=True)
+    conn = reporting.get_connection()
+    try:
+        report = sales.analysis_report(conn.cursor(), params["from"], params["to"])
+        report["data_as_of"] = reporting.as_of(conn)
+    finally:
+        reporting.release_connection(conn)
+    _write_json(os.path.join(job_dir, 'result.json'), report)
+    progress.advance(1)
+    return {"file": 'result.json', "mimetype": 'application/json', "data_as_of": report["data_as_of"]}
+
+
+KINDS = {
+    'sales_export': (_validate_export, _run_export),
+    'sales_analysis': (_check_dates, _run_analysis),
+}
+
+
+def _execute(kind, params, job_dir):
+    """Roda dentro do processo do pool. Grava o status final em job.json."""
+    meta_path = os.path.join(job_dir, 'job.json')
+    meta = _read_json(meta_path) or {}
+    meta.update(status='running', started_at=time.time())
+    _write_json(meta_path, meta)
+    progress = Progress(job_dir)
+    try:
+        result = KINDS[kind][1](params, job_dir, progress)
+        progress.update(force=True)
+        meta.update(status='done', result=result)
+    except Exception as e:
+        meta.update(status='failed', error=str(e))
+    finally:
+        meta['finished_at'] = time.time()
+        _write_json(meta_path, meta)
+        reporting.close_all()
+
+
+class JobRunner:
+    def __init__(self, directory=JOBS_DIR, workers=WORKERS, ttl=RESULT_TTL_SECONDS):
+        self.directory = directory
+        self.workers = workers
+        self.ttl = ttl
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # O pool não sobrevive a um fork (gunicorn): cada worker cria o seu
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+        return self._executor
+
+    def _dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, kind, args):
+        """
+        Cria (ou reaproveita) um job. Retorna (job, reaproveitado).
+        Lança JobError se o tipo ou os parâmetros forem inválidos.
+        """
+        if kind not in KINDS:
+            raise JobError(f"Tipo de job desconhecido: '{kind}'. Opções: {', '.join(KINDS)}")
+        try:
+            params = KINDS[kind][0](args)
+        except ValueError as e:
+            raise JobError(str(e))
+        key = hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+        with self._lock:
+            self.cleanup()
+            for job in self.list():
+                if job["key"] == key and job["status"] != 'failed':
+                    return job, True
+
+            job_id = uuid.uuid4().hex
+            job_dir = self._dir(job_id)
+            os.makedirs(job_dir)
+            meta = {"id": job_id, "kind": kind, "params": params, "key": key, "status": 'queued',
+                    "created_at": time.time(), "started_at": None, "finished_at": None,
+                    "result": None, "error": None}
+            _write_json(os.path.join(job_dir, 'job.json'), meta)
+            future = self._pool().submit(_execute, kind, params, job_dir)
+            future.add_done_callback(lambda f: self._check_crash(f, job_dir))
+        print(f"Job {job_id} ({kind}) criado.")
+        return self.get(job_id), False
+
+    def _check_crash(self, future, job_dir):
+        # _execute grava o próprio status; isto só cobre o job cancelado ou o processo do pool ter morrido
+        error = "Job cancelado." if future.cancelled() else future.exception()
+        if error is None:
+            return
+        meta_path = os.path.join(job_dir, 'job.json')
+        meta = _read_json(meta_path)
+        if meta and meta["status"] not in FINISHED:
+            meta.update(status='failed', error=str(error), finished_at=time.time())
+            _write_json(meta_path, meta)
+
+    def get(self, job_id):
+        """Status, progresso e resultado do job (None se não existir ou já tiver expirado)."""
+        if not _JOB_ID.match(job_id or ''):
+            return None
+        meta = _read_json(os.path.join(self._dir(job_id), 'job.json'))
+        if meta is None:
+            return None
+        now = time.time()
+        if meta["status"] not in FINISHED and now - meta["created_at"] > MAX_RUNTIME_SECONDS:
+            meta.update(status='failed', error="O job não terminou no tempo máximo.")
+        if meta["status"] in FINISHED and meta["finished_at"] and now - meta["finished_at"] > self.ttl:
+            return None
+        meta["progress"] = _read_json(os.path.join(self._dir(job_id), 'progress.json'))
+        if meta["finished_at"]:
+            meta["expires_at"] = meta["finished_at"] + self.ttl
+        return meta
+
+    def result_path(self, job):
+        return os.path.join(self._dir(job["id"]), job["result"]["file"])
+
+    def list(self):
+        """Jobs existentes (mais recentes primeiro)."""
+        if not os.path.isdir(self.directory):
+            return []
+        jobs = [self.get(name) for name in os.listdir(self.directory)]
+        return sorted((job for job in jobs if job), key=lambda job: job["created_at"], reverse=True)
+
+    def cleanup(self):
+        """Apaga as pastas dos jobs cujo resultado expirou."""
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for name in os.listdir(self.directory):
+            meta = _read_json(os.path.join(self._dir(name), 'job.json'))
+            expired = meta and meta["finished_at"] and now - meta["finished_at"] > self.ttl
+            stuck = meta and meta["status"] not in FINISHED and now - meta["created_at"] > MAX_RUNTIME_SECONDS
+            if expired or stuck:
+                shutil.rmtree(self._dir(name), ignore_errors=True)
+
+    def stats(self):
+        counts = {status: 0 for status in ('queued', 'running') + FINISHED}
+        for job in self.list():
+            counts[job["status"]] += 1
+        return {f"{status}_count": count for status, count in counts.items()}
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Instância única usada pelo app
+runner = JobRunner()
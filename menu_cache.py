@@ -0,0 +1,117 @@
+# menu_cache.py
+# Cache, em memória do processo, do cardápio público servido em /api/stock.
+#
+# O cardápio muda poucas vezes por dia (rotas de administração do estoque) e
+# as quantidades mudam a cada venda. Por isso há dois níveis de invalidação:
+#   - invalidate(): algo além da quantidade mudou (nome, preço, disponibilidade,
+#     item novo ou excluído) -> o cardápio é remontado do zero;
+#   - quantities_changed(): só as quantidades mudaram (checkout, devolução)
+#     -> apenas a coluna quantity é relida e aplicada na lista já montada.
+# A resposta já serializada fica guardada junto com o ETag, para que os
+# clientes recebam 304 Not Modified quando nada mudou.
+
+import hashlib
+import json
+import threading
+
+import db
+
+# Texto mostrado ao cliente no lugar dos itens de brinde
+PROMO_NAME = 'Item Promocional'
+PROMO_DESCRIPTION = 'Um brinde especial da casa para você!'
+
+
+def public_item(item_id, name, qty, price, img, desc, is_promo, variants=None):
+    """
+    Monta o item como o cliente o vê (brindes têm nome, preço e descrição mascarados).
+    image_path é a versão média em JPEG; image_variants traz todas as versões
+    (miniatura/média/grande, WebP e JPEG) para o <picture>/srcset das telas.
+    """
+    image_variants = json.loads(variants) if variants else None
+    if is_promo == 1:
+        return {
+            'id': item_id,
+            'name': PROMO_NAME,
+            'quantity': qty,
+            'price': 0.0,
+            'image_path': img,
+            'image_variants': image_variants,
+            'detailed_description': PROMO_DESCRIPTION
+        }
+    return {
+        'id': item_id,
+        'name': name,
+        'quantity': qty,
+        'price': price,
+        'image_path': img,
+        'image_variants': image_variants,
+        'detailed_description': desc
+    }
+
+
+class MenuCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0            # Aumenta a cada alteração do cardápio
+        self._quantity_version = 0   # Aumenta a cada alteração só de quantidade
+        self._built = None           # (version, quantity_version) do conteúdo guardado
+        self._items = []
+        self._body = None
+        self._etag = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        """Marca o cardápio inteiro para ser remontado na próxima leitura."""
+        with self._lock:
+            self._version += 1
+
+    def quantities_changed(self):
+        """Marca apenas as quantidades para serem relidas na próxima leitura."""
+        with self._lock:
+            self._quantity_version += 1
+
+    def get(self):
+        """Retorna (corpo JSON em bytes, etag) do cardápio atual."""
+        with self._lock:
+            wanted = (self._version, self._quantity_version)
+            if self._built == wanted:
+                return self._body, self._etag
+
+            conn = db.get_connection()
+            try:
+                if self._built is None or self._built[0] != wanted[0]:
+                    self._items = self._load_items(conn)
+                elif not self._refresh_quantities(conn):
+                    # Algum item sumiu/apareceu: remonta tudo
+                    self._items = self._load_items(conn)
+            finally:
+                db.release_connection(conn)
+
+            self._body = json.dumps(self._items, ensure_ascii=False).encode('utf-8')
+            self._etag = hashlib.md5(self._body).hexdigest()
+            self._built = wanted
+            return self._body, self._etag
+
+    def _load_items(self, conn):
+        cursor = conn.execute(
+            "SELECT id, name, quantity, price, image_path, detailed_description, is_promo, image_variants "
+            "FROM stock WHERE is_available = 1")
+        return [public_item(*row) for row in cursor.fetchall()]
+
+    def _refresh_quantities(self, conn):
+        """Atualiza só as quantidades. Retorna False se a lista de itens mudou."""
+        quantities = dict(conn.execute("SELECT id, quantity FROM stock WHERE is_available = 1").fetchall())
+        if len(quantities) != len(self._items):
+            return False
+        for item in self._items:
+            if item['id'] not in quantities:
+                return False
+            item['quantity'] = quantities[item['id']]
+        return True
+
+
+# Instância única usada pelo app
+menu = MenuCache()
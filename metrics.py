@@ -0,0 +1,183 @@
+# metrics.py
+# Métricas de desempenho no formato texto do Prometheus, servidas em /metrics.
+#
+# - Por rota: histograma de latência, contagem por código de status e
+#   quantidade de requisições em andamento.
+# - Por comando SQL: histograma de tempo, agrupado pelo texto normalizado
+#   do comando (espaços e listas de "?" colapsados).
+#
+# Com METRICS_ENABLED=0 nenhum gancho é registrado no Flask nem no SQLite,
+# então não há custo extra nas requisições.
+
+import os
+import re
+import threading
+import time
+
+from flask import g, request
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Limites (em segundos) dos baldes dos histogramas
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# Máximo de comandos SQL distintos acompanhados (evita crescer sem limite)
+MAX_SQL_STATEMENTS = 500
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                self.counts[i] += 1
+                break
+
+
+_lock = threading.Lock()
+_http_latency = {}      # (endpoint, method) -> Histogram
+_http_status = {}       # (endpoint, method, status) -> contagem
+_http_in_flight = 0
+_sql_latency = {}       # sql normalizado -> Histogram
+_sql_normalized = {}    # sql original -> sql normalizado (cache)
+
+_COMMENTS = re.compile(r'--[^\n]*')
+_SPACES = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\?(\s*,\s*\?)+')
+_VALUES_LIST = re.compile(r'\(\?\.\.\.\)(\s*,\s*\(\?\.\.\.\))+')
+
+
+def normalize_sql(sql):
+    """
+    Remove comentários e espaços extras; 'IN (?, ?, ?)' e 'VALUES (?, ?), (?, ?)'
+    viram 'IN (?...)' e 'VALUES (?...)', para carrinhos de tamanhos diferentes
+    caírem na mesma série.
+    """
+    normalized = _sql_normalized.get(sql)
+    if normalized is None:
+        normalized = _SPACES.sub(' ', _COMMENTS.sub('', sql)).strip()
+        normalized = _PLACEHOLDER_LIST.sub('?...', normalized)
+        normalized = normalized.replace('(?)', '(?...)')
+        normalized = _VALUES_LIST.sub('(?...)', normalized)
+        if len(_sql_normalized) < MAX_SQL_STATEMENTS * 4:
+            _sql_normalized[sql] = normalized
+    return normalized
+
+
+def observe_sql(sql, seconds):
+    """Registra o tempo de um comando SQL (chamado pela camada db.py)."""
+    key = normalize_sql(sql)
+    with _lock:
+        histogram = _sql_latency.get(key)
+        if histogram is None:
+            if len(_sql_latency) >= MAX_SQL_STATEMENTS:
+                key = 'other'
+                histogram = _sql_latency.get(key)
+            if histogram is None:
+                histogram = _sql_latency[key] = Histogram(SQL_BUCKETS)
+        histogram.observe(seconds)
+
+
+def _before_request():
+    global _http_in_flight
+    g._metrics_started = time.perf_counter()
+    with _lock:
+        _http_in_flight += 1
+
+
+def _after_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'not_found'
+        key = (endpoint, request.method)
+        with _lock:
+            histogram = _http_latency.get(key)
+            if histogram is None:
+                histogram = _http_latency[key] = Histogram(HTTP_BUCKETS)
+            histogram.observe(elapsed)
+            status_key = (endpoint, request.method, str(response.status_code))
+            _http_status[status_key] = _http_status.get(status_key, 0) + 1
+    return response
+
+
+def _teardown_request(exc):
+    global _http_in_flight
+    with _lock:
+        _http_in_flight -= 1
+
+
+def init_app(app, database):
+    """Registra os ganchos de medição no Flask e na camada de banco (se ligados)."""
+    if not ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    database.set_statement_observer(observe_sql)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _render_histogram(lines, name, histogram, labels):
+    cumulative = 0
+    for limit, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{limit}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def render(gauges=None):
+    """
+    Gera o texto do /metrics. gauges: {nome da métrica: valor} extras
+    (ex: contadores do pool de conexões e da fila de pedidos).
+    """
+    lines = []
+    with _lock:
+        lines.append('# HELP http_request_duration_seconds Latência das requisições por rota.')
+        lines.append('# TYPE http_request_duration_seconds histogram')
+        for (endpoint, method), histogram in sorted(_http_latency.items()):
+            _render_histogram(lines, 'http_request_duration_seconds', histogram,
+                              _labels(endpoint=endpoint, method=method))
+
+        lines.append('# HELP http_requests_total Requisições atendidas por rota e código de status.')
+        lines.append('# TYPE http_requests_total counter')
+        for (endpoint, method, status), count in sorted(_http_status.items()):
+            lines.append(f'http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+
+        lines.append('# HELP http_requests_in_flight Requisições em andamento.')
+        lines.append('# TYPE http_requests_in_flight gauge')
+        lines.append(f'http_requests_in_flight {_http_in_flight}')
+
+        lines.append('# HELP sqlite_statement_duration_seconds Tempo de execução de cada comando SQL.')
+        lines.append('# TYPE sqlite_statement_duration_seconds histogram')
+        for statement, histogram in sorted(_sql_latency.items()):
+            _render_histogram(lines, 'sqlite_statement_duration_seconds', histogram,
+                              _labels(statement=statement))
+
+    for name, value in sorted((gauges or {}).items()):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,113 @@
+# migrations.py
+# Migrações de dados que precisam rodar UMA única vez em bancos já existentes.
+#
+# As tabelas novas são criadas pelo init_db() (CREATE TABLE IF NOT EXISTS);
+# aqui ficam apenas as conversões dos dados antigos. A versão já aplicada é
+# guardada no próprio arquivo do banco com PRAGMA user_version.
+
+import json
+
+import sales
+import timeutil
+
+
+def _backfill_order_items(cursor):
+    """
+    Converte as listas JSON de orders.item_names / orders.quantities em
+    linhas da tabela order_items. O id do estoque é encontrado pelo nome
+    (era a única informação salva nos pedidos antigos).
+    """
+    cursor.execute("SELECT name, id, price FROM stock")
+    stock_by_name = {name: (stock_id, price) for name, stock_id, price in cursor.fetchall()}
+
+    cursor.execute('''
+        SELECT id, item_names, quantities FROM orders
+        WHERE id NOT IN (SELECT DISTINCT order_id FROM order_items)
+    ''')
+    rows = []
+    for order_id, names_json, quantities_json in cursor.fetchall():
+        try:
+            names = json.loads(names_json)
+            quantities = [int(q) for q in json.loads(quantities_json)]
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            print(f"Migração: pedido {order_id} com itens inválidos foi ignorado ({e})")
+            continue
+        for name, quantity in zip(names, quantities):
+            stock_id, price = stock_by_name.get(name, (None, None))
+            rows.append((order_id, stock_id, name, quantity, price))
+
+    cursor.executemany('''
+        INSERT INTO order_items (order_id, stock_id, name_snapshot, quantity, unit_price)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def _seed_order_sequence(cursor):
+    """
+    Inicia o contador de senhas a partir da maior senha já emitida, para que
+    o próximo pedido continue a numeração atual.
+    """
+    cursor.execute('''
+        INSERT OR REPLACE INTO order_sequence (name, last_value, period)
+        SELECT 'orders', COALESCE(MAX(CAST(order_number AS INTEGER)), 0), '' FROM orders
+    ''')
+
+
+def _add_stock_image_variants(cursor):
+    """Adiciona a coluna com as versões reduzidas das fotos em bancos antigos."""
+    cursor.execute("PRAGMA table_info(stock)")
+    if 'image_variants' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE stock ADD COLUMN image_variants TEXT")
+
+
+def add_epoch_ms_columns(cursor):
+    """
+    Adiciona as colunas *_ms em bancos antigos e preenche a partir das colunas
+    de texto. orders.created_at está em UTC; orders.called_at e
+    scores.created_at estão no horário de Brasília.
+    Chamada pelo init_db ANTES das migrações (os agregados de vendas da
+    migração 3 agrupam por created_at_ms). Só preenche quando acabou de criar
+    a coluna: depois disso, todo pedido/avaliação já é gravado com os ms.
+    """
+    columns = {
+        'orders': (('created_at_ms', None), ('called_at_ms', timeutil.UTC_TIME_MODIFIER)),
+        'scores': (('created_at_ms', timeutil.UTC_TIME_MODIFIER),),
+    }
+    for table, table_columns in columns.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = [row[1] for row in cursor.fetchall()]
+        for column, modifier in table_columns:
+            if column in existing:
+                continue
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+            text_column = column[:-len('_ms')]
+            cursor.execute(f'''
+                UPDATE {table} SET {column} = {timeutil.utc_text_to_ms_sql(text_column, modifier)}
+                WHERE {text_column} IS NOT NULL
+            ''')
+
+
+# (versão, descrição, função). Novas migrações entram SEMPRE no final da lista.
+MIGRATIONS = [
+    (1, "itens dos pedidos em order_items", _backfill_order_items),
+    (2, "contador de senhas em order_sequence", _seed_order_sequence),
+    (3, "agregados de vendas", sales.rebuild),
+    (4, "versões reduzidas das fotos do estoque", _add_stock_image_variants),
+]
+
+
+def run_migrations(conn):
+    """Aplica, em ordem, as migrações que ainda não rodaram neste banco."""
+    cursor = conn.cursor()
+    current = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+            print(f"Migração {version} aplicada: {description}")
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,128 @@
+# orders.py
+# Gravação de um pedido novo: baixa do estoque, senha, INSERT dos dados e dos
+# itens e atualização dos totais de vendas.
+#
+# place_order() NÃO abre nem confirma a transação: quem chama decide. A rota
+# /api/orders usa uma transação por pedido; a fila de gravação em lote
+# (ingest.py) grava vários pedidos na mesma transação.
+
+import json
+import os
+
+import changes
+import idempotency
+import inventory
+import sales
+import timeutil
+
+# Se ligado (ORDER_NUMBER_DAILY_RESET=1), as senhas recomeçam do 001 todo dia
+ORDER_NUMBER_DAILY_RESET = os.environ.get('ORDER_NUMBER_DAILY_RESET', '0') == '1'
+
+
+class StockUnavailable(Exception):
+    """O carrinho tem itens sem estoque suficiente (nada foi gravado)."""
+
+    def __init__(self, unavailable_items):
+        super().__init__("Estoque insuficiente.")
+        self.unavailable_items = unavailable_items
+
+
+def next_order_number(cursor):
+    """
+    Reserva o próximo número de senha usando o contador da tabela order_sequence.
+    Deve ser chamada DENTRO da mesma transação do INSERT do pedido: o UPDATE
+    trava o contador até o commit, então dois checkouts simultâneos nunca
+    recebem a mesma senha. Custo O(1), independente do tamanho da tabela orders.
+    Ex: Se o último for '005', retorna '006'. Se não houver, retorna '001'.
+    """
+    # Com o reinício diário ligado, o contador volta a 1 quando muda o dia (horário de Brasília)
+    period = ''
+    if ORDER_NUMBER_DAILY_RESET:
+        period = timeutil.local_now().date().isoformat()
+
+    cursor.execute('''
+        UPDATE order_sequence
+        SET last_value = CASE WHEN period = ? THEN last_value + 1 ELSE 1 END,
+            period = ?
+        WHERE name = 'orders'
+        RETURNING last_value
+    ''', (period, period))
+    new_num = cursor.fetchone()[0]
+
+    # Retorna o número formatado com 3 dígitos (ex: 001, 010, 123)
+    return str(new_num).zfill(3)
+
+
+def created_response(result):
+    """Corpo da resposta 201 de um pedido gravado (também guardado para a chave de idempotência)."""
+    return {
+        "message": "Pedido salvo com sucesso!",
+        "order_number": result["order_number"],
+        "order_id": result["order_id"]
+    }
+
+
+def place_order(cursor, order):
+    """
+    Grava o pedido dentro da transação já aberta (de preferência BEGIN IMMEDIATE).
+
+    order: dict com customer_name, phone, items, total, payment_method e
+    cart (o carrinho já agregado por inventory.aggregate_cart); opcionalmente
+    idempotency_key e request_hash, guardados junto com a resposta na mesma transação.
+    Retorna dict com order_id, order_number, customer_name, status e created_at.
+    Lança StockUnavailable se faltar estoque (ou idempotency.KeyInUse se a
+    chave já foi usada); nesse caso quem chama deve desfazer a transação
+    (ou o savepoint).
+    """
+    items = order['items']
+
+    # Prepara os dados para o banco
+    item_names = json.dumps([item['name'] for item in items])
+    quantities = json.dumps([item['quantity'] for item in items])
+
+    # 1. Confere e dá baixa no estoque do carrinho inteiro
+    unavailable_items = inventory.reserve(cursor, order['cart'])
+    if unavailable_items:
+        raise StockUnavailable(unavailable_items)
+
+    # 2. Gera o número do pedido (na mesma transação do INSERT)
+    order_number = next_order_number(cursor)
+
+    initial_status = 'pending_payment' if order['payment_method'] == 'pix' else 'preparing'
+
+    # 3. Insere o Pedido (created_at e created_at_ms são o mesmo instante, calculado pelo SQLite)
+    cursor.execute(f'''
+        INSERT INTO orders (customer_name, phone, item_names, quantities, total, order_number, payment_method, status,
+                            created_at_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, {timeutil.NOW_MS_SQL})
+        RETURNING id, created_at
+    ''', (order['customer_name'], order.get('phone'), item_names, quantities, order['total'],
+          order_number, order['payment_method'], initial_status))
+
+    new_order_id, created_at = cursor.fetchone()
+
+    # Grava os itens com o id do estoque e o preço praticado no momento da venda
+    cursor.executemany('''
+        INSERT INTO order_items (order_id, stock_id, name_snapshot, quantity, unit_price)
+        SELECT ?, id, ?, ?, price FROM stock WHERE id = ?
+    ''', [(new_order_id, item['name'], item['quantity'], item['id']) for item in items])
+
+    # 4. Soma o pedido nos totais de vendas
+    sales.add_order(cursor, new_order_id)
+
+    result = {
+        "order_id": new_order_id,
+        "order_number": order_number,
+        "customer_name": order['customer_name'],
+        "status": initial_status,
+        "created_at": created_at,
+    }
+
+    # 5. Avisa os outros processos (telas, cardápio) na mesma transação
+    changes.bus.record(cursor, 'orders', 'order_created', **result)
+
+    # 6. Guarda a resposta para reenvios com a mesma Idempotency-Key
+    if order.get('idempotency_key'):
+        idempotency.remember(cursor, order['idempotency_key'], 201, created_response(result), order['request_hash'])
+
+    return result
@@ -0,0 +1,267 @@
+# reporting.py
+# Leituras dos relatórios do admin separadas do banco do checkout.
+#
+# A lista de vendas, a análise, a exportação e os pagamentos pendentes liam o
+# mesmo database.db em que o checkout grava, disputando locks e o cache de
+# páginas no horário de pico. Este módulo oferece conexões SOMENTE LEITURA,
+# com a mesma interface do db.py (get_connection / release_connection):
+#
+# REPORTING_MODE=snapshot (padrão)
+#   Os relatórios leem uma cópia do banco (REPORTING_DB_PATH), feita com a API
+#   de backup online do SQLite. Em WAL a cópia é uma leitura comum: não trava
+#   quem grava pedidos. A cópia é refeita
+#     - quando fica mais velha que REFRESH_SECONDS (antes de responder: nenhum
+#       relatório sai de uma cópia vencida);
+#     - depois das alterações do admin que apagam ou movem vendas (invalidate());
+#     - sob demanda (POST /api/admin/reporting/refresh ou flask refresh-reporting).
+#   A cópia nova é gravada em um arquivo temporário e trocada de uma vez
+#   (os.replace); as consultas em andamento terminam na cópia antiga.
+# REPORTING_MODE=readonly
+#   Conexões mode=ro direto no banco principal (dados sempre atuais).
+# REPORTING_MODE=off
+#   Usa o pool normal do db.py.
+#
+# as_of(conn) diz de quando são os dados lidos ("data as of"); as rotas o enviam
+# no cabeçalho X-Data-As-Of (e no campo data_as_of quando a resposta é um objeto).
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+MODE = os.environ.get('REPORTING_MODE', 'snapshot')
+
+SNAPSHOT_PATH = os.environ.get('REPORTING_DB_PATH') or f"{os.path.splitext(db.DB_PATH)[0]}_reporting.db"
+
+# Idade máxima (segundos) da cópia antes de ser refeita
+REFRESH_SECONDS = float(os.environ.get('REPORTING_REFRESH_SECONDS', '300'))
+
+MODES = ('snapshot', 'readonly', 'off')
+
+_pools = {}  # 'snapshot' / 'live' -> fila de conexões ociosas
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+_refresh_lock = threading.Lock()
+
+# (identidade do arquivo da cópia, data dos dados) da última cópia lida
+_as_of_cache = (None, None)
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _snapshot_id():
+    """Identidade do arquivo da cópia (muda a cada troca), ou None se não existir."""
+    try:
+        st = os.stat(SNAPSHOT_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _snapshot_age():
+    try:
+        return time.time() - os.stat(SNAPSHOT_PATH).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+# --- Cópia (snapshot) ---
+
+class _SnapshotLock:
+    """Trava da cópia: entre threads (_refresh_lock) e entre processos (flock)."""
+
+    def __enter__(self):
+        _refresh_lock.acquire()
+        try:
+            self._file = open(f"{SNAPSHOT_PATH}.lock", 'w')
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        except Exception:
+            _refresh_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        _refresh_lock.release()
+
+
+def refresh(max_age=None):
+    """
+    Refaz a cópia do banco. Com max_age, não faz nada se a cópia atual for
+    mais nova que isso (outro processo pode ter acabado de refazer).
+    Retorna a data dos dados da cópia nova (None se não foi preciso refazer).
+    """
+    # Só um processo por vez copia o banco
+    with _SnapshotLock():
+        age = _snapshot_age()
+        if max_age is not None and age is not None and age < max_age:
+            return None
+
+        started = time.perf_counter()
+        tmp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+        source = db.get_connection()
+        dest = sqlite3.connect(tmp_path)
+        try:
+            taken_at = _now()
+            # Um passo só: uma única transação de leitura (em WAL não bloqueia quem grava)
+            source.backup(dest)
+            # A cópia é aberta somente leitura: sem WAL (não precisa de -wal/-shm)
+            dest.execute("PRAGMA journal_mode = DELETE")
+            dest.execute("CREATE TABLE IF NOT EXISTS reporting_snapshot (taken_at TEXT NOT NULL)")
+            dest.execute("DELETE FROM reporting_snapshot")
+            dest.execute("INSERT INTO reporting_snapshot (taken_at) VALUES (?)", (taken_at,))
+            dest.commit()
+        except Exception:
+            dest.close()
+            os.remove(tmp_path)
+            raise
+        finally:
+            db.release_connection(source)
+        dest.close()
+        os.replace(tmp_path, SNAPSHOT_PATH)
+        print(f"Cópia dos relatórios atualizada em {time.perf_counter() - started:.2f}s (dados de {taken_at} UTC).")
+        return taken_at
+
+
+def invalidate():
+    """
+    Descarta a cópia depois de uma alteração do admin que apaga ou move vendas
+    (excluir venda, reiniciar, arquivar): o próximo relatório faz uma cópia nova.
+    Vale para todos os processos (o arquivo some). As consultas em andamento
+    terminam na cópia antiga.
+    """
+    if MODE != 'snapshot':
+        return
+    # Espera uma cópia em andamento terminar (ela pode ter começado antes da alteração)
+    with _SnapshotLock():
+        try:
+            os.remove(SNAPSHOT_PATH)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Erro ao descartar a cópia dos relatórios: {e}")
+
+
+def _ensure_snapshot():
+    # Várias requisições podem chegar aqui juntas: só a primeira copia o banco,
+    # as outras esperam a trava e usam a cópia nova
+    age = _snapshot_age()
+    if age is None:
+        refresh(max_age=float('inf'))
+    elif REFRESH_SECONDS and age > REFRESH_SECONDS:
+        refresh(max_age=REFRESH_SECONDS)
+
+
+# --- Conexões ---
+
+def _reset_after_fork():
+    global _pools, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pools = {}
+            _pool_pid = os.getpid()
+
+
+def get_connection(live=False):
+    """
+    Conexão somente leitura para relatórios (devolver com release_connection).
+    live=True lê o banco principal mesmo no modo snapshot (telas operacionais,
+    como os pagamentos pendentes, que não podem mostrar dados de minutos atrás).
+    No modo snapshot, as conexões guardadas de uma cópia anterior são descartadas.
+    """
+    if MODE == 'off':
+        return db.get_connection()
+    if _pool_pid != os.getpid():
+        _reset_after_fork()
+
+    kind = 'live' if live or MODE == 'readonly' else 'snapshot'
+    if kind == 'snapshot':
+        _ensure_snapshot()
+        current = _snapshot_id()
+    else:
+        current = None
+    with _pool_lock:
+        pool = _pools.setdefault(kind, queue.LifoQueue(maxsize=db.POOL_SIZE))
+    while True:
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            break
+        if conn._snapshot_id == current:
+            return conn
+        conn.close()
+
+    conn = db.connect_readonly(SNAPSHOT_PATH if kind == 'snapshot' else None)
+    conn._reporting_kind = kind
+    conn._snapshot_id = current
+    return conn
+
+
+def release_connection(conn):
+    if MODE == 'off':
+        return db.release_connection(conn)
+    if conn is None:
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pools[conn._reporting_kind].put_nowait(conn)
+    except (sqlite3.Error, queue.Full, KeyError):
+        conn.close()
+
+
+def close_all():
+    """Fecha as conexões ociosas dos relatórios e do pool principal (usado no desligamento)."""
+    for pool in list(_pools.values()):
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+    db.close_all()
+
+
+def as_of(conn):
+    """Data/hora (UTC, formato do created_at) dos dados lidos pela conexão ("data as of")."""
+    global _as_of_cache
+    if MODE == 'off' or conn._snapshot_id is None:
+        return _now()
+    snapshot_id, taken_at = _as_of_cache
+    if snapshot_id != conn._snapshot_id:
+        taken_at = conn.execute("SELECT taken_at FROM reporting_snapshot").fetchone()[0]
+        _as_of_cache = (conn._snapshot_id, taken_at)
+    return taken_at
+
+
+def stamp(response, data_as_of):
+    """Adiciona o cabeçalho X-Data-As-Of à resposta."""
+    response.headers['X-Data-As-Of'] = data_as_of
+    return response
+
+
+def stats():
+    age = _snapshot_age() if MODE == 'snapshot' else 0
+    return {
+        "mode": MODE,
+        "snapshot_path": SNAPSHOT_PATH if MODE == 'snapshot' else None,
+        "snapshot_age_seconds": round(age, 1) if age is not None else None,
+        "refresh_seconds": REFRESH_SECONDS,
+        "idle_connections": sum(pool.qsize() for pool in _pools.values()),
+    }
+
+
+if MODE not in MODES:
+    raise ValueError(f"REPORTING_MODE inválido: '{MODE}'. Opções: {', '.join(MODES)}")
@@ -0,0 +1,159 @@
+# responses.py
+# Respostas JSON das telas que fazem polling várias vezes por segundo
+# (/api/monitor/orders, /api/orders/status, /api/kitchen/orders).
+#
+# - O corpo é serializado UMA vez por versão do estado dos pedidos (o id do
+#   último evento publicado em events.py) e guardado já pronto, junto com o
+#   ETag e as versões comprimidas. Enquanto nada muda, cada polling custa só a
+#   comparação da versão (ou um 304 Not Modified, se o cliente mandar o ETag).
+# - Compressão negociada pelo Accept-Encoding: brotli (se o módulo estiver
+#   instalado) ou gzip.
+# - Serialização com orjson quando disponível (bem mais rápido que o json).
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Idade máxima (segundos) do corpo guardado, mesmo sem mudança de versão.
+# Com vários processos, uma mudança feita em outro worker aparece no máximo após esse tempo.
+MAX_AGE_SECONDS = float(os.environ.get('RESPONSE_CACHE_MAX_AGE_SECONDS', '1'))
+
+# Corpos menores que isso não compensam a compressão
+MIN_COMPRESS_BYTES = 512
+
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+
+def dumps(data):
+    """Serializa para bytes UTF-8 (orjson se instalado, senão json compacto)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _accepted_encodings(header):
+    """Codificações aceitas pelo cliente (ignora as marcadas com q=0)."""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = _accepted_encodings(header)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class _Entry:
+    __slots__ = ('version', 'built_at', 'body', 'etag', '_encoded', '_lock')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.body = body
+        self.etag = hashlib.md5(body).hexdigest()
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """Corpo comprimido com a codificação pedida (comprime só na primeira vez)."""
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    if encoding == 'br':
+                        data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                    else:
+                        data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+                    self._encoded[encoding] = data
+        return data
+
+
+class MemoizedJSON:
+    """Corpos JSON já serializados, um por chave, válidos enquanto a versão não muda."""
+
+    def __init__(self, max_age=MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._entries = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, entry, version):
+        return (entry is not None and entry.version == version
+                and time.monotonic() - entry.built_at < self.max_age)
+
+    def get(self, key, version, build):
+        """
+        Retorna o corpo guardado para a chave se ainda for da versão atual;
+        senão chama build() (que devolve dict/list) e guarda o resultado.
+        Só uma requisição por chave remonta o corpo; as outras esperam e reaproveitam.
+        """
+        entry = self._entries.get(key)
+        if self._fresh(entry, version):
+            self.hits += 1
+            return entry
+
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            entry = self._entries.get(key)
+            if self._fresh(entry, version):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = _Entry(version, dumps(build()))
+            self._entries[key] = entry
+            return entry
+
+    def clear(self):
+        self._entries.clear()
+
+
+def send(entry):
+    """Resposta do corpo guardado, comprimida conforme o Accept-Encoding e com ETag (304 se não mudou)."""
+    encoding = None
+    if len(entry.body) >= MIN_COMPRESS_BYTES:
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+
+    if encoding:
+        response = Response(entry.encoded(encoding), mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+        # O ETag muda com a codificação (os bytes enviados são outros)
+        response.set_etag(f"{entry.etag}-{encoding}")
+    else:
+        response = Response(entry.body, mimetype='application/json')
+        response.set_etag(entry.etag)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+# Instância única usada pelas telas
+screens = MemoizedJSON()
@@ -0,0 +1,283 @@
+# sales.py
+# Totais de vendas mantidos incrementalmente para /api/admin/sales/analysis.
+#
+# Cada pedido soma seus itens em três tabelas de agregados, NA MESMA transação
+# do add_order; recusar o pagamento ou excluir a venda desfaz a soma. Assim a
+# análise lê poucas linhas já somadas em vez de percorrer todo o histórico.
+#   - sales_item_totals: total geral por item
+#   - sales_daily:       por dia e item (permite filtrar por período)
+#   - sales_hourly:      por dia, hora do dia e item
+#
+# Também monta os filtros e a paginação por cursor da lista de vendas
+# (/api/admin/sales), compartilhados com a exportação. A lista consulta os
+# pedidos vivos e os arquivados (archive.py) juntos.
+
+import base64
+
+import timeutil
+
+CREATE_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS sales_item_totals (
+        item_key TEXT PRIMARY KEY, -- ver _ITEM_KEY
+        stock_id INTEGER,
+        name TEXT NOT NULL,        -- último nome vendido (usado se o item sair do estoque)
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT NOT NULL, -- AAAA-MM-DD
+        item_key TEXT NOT NULL,
+        stock_id INTEGER,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, item_key)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL, -- 0 a 23
+        item_key TEXT NOT NULL,
+        stock_id INTEGER,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, item_key)
+    )
+    ''',
+)
+
+# Chave de cada item nos agregados: o id do estoque. O nome gravado no pedido
+# não serve (muda quando o item é renomeado, e todo brinde é gravado como
+# "Item Promocional"); ele só identifica os itens antigos sem id do estoque.
+_ITEM_KEY = "COALESCE('id:' || oi.stock_id, 'nome:' || oi.name_snapshot)"
+
+# Chave de cada tabela (colunas, expressões e GROUP BY) a partir dos itens dos pedidos.
+# Os dias/horas seguem o horário de Brasília (UTC-3), como o resto do app.
+_ITEMS_SELECT = {
+    "sales_item_totals": (
+        "item_key",
+        _ITEM_KEY,
+        "1",
+    ),
+    "sales_daily": (
+        "day, item_key",
+        f"{timeutil.local_day_sql('o.created_at_ms')}, {_ITEM_KEY}",
+        "1, 2",
+    ),
+    "sales_hourly": (
+        "day, hour, item_key",
+        f"{timeutil.local_day_sql('o.created_at_ms')}, {timeutil.local_hour_sql('o.created_at_ms')}, {_ITEM_KEY}",
+        "1, 2, 3",
+    ),
+}
+
+
+# Tabelas (pedidos, itens) dos pedidos vivos e dos arquivados
+_SOURCES = {
+    False: ("orders", "order_items"),
+    True: ("orders_archive", "order_items_archive"),
+}
+
+
+def _upsert(cursor, table, where, params, sign, archived=False):
+    """{where} filtra os pedidos (um pedido específico ou todos os não recusados)."""
+    key_columns, key_exprs, group_by = _ITEMS_SELECT[table]
+    orders_table, items_table = _SOURCES[archived]
+    cursor.execute(f'''
+        INSERT INTO {table} ({key_columns}, stock_id, name, quantity, revenue)
+        SELECT {key_exprs}, MAX(oi.stock_id), MAX(oi.name_snapshot),
+               SUM(oi.quantity) * ?, SUM(oi.quantity * COALESCE(oi.unit_price, 0)) * ?
+        FROM {items_table} oi JOIN {orders_table} o ON o.id = oi.order_id
+        WHERE {where}
+        GROUP BY {group_by}
+        ON CONFLICT ({key_columns}) DO UPDATE SET
+            name = CASE WHEN excluded.quantity > 0 THEN excluded.name ELSE name END,
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue
+    ''', (sign, sign, *params))
+
+
+def add_order(cursor, order_id):
+    """Soma os itens do pedido nos agregados (chamar dentro da transação do pedido)."""
+    for table in _ITEMS_SELECT:
+        _upsert(cursor, table, "oi.order_id = ?", (order_id,), 1)
+
+
+def remove_order(cursor, order_id, archived=False):
+    """Desfaz a soma do pedido (pagamento recusado ou venda excluída, viva ou arquivada)."""
+    for table in _ITEMS_SELECT:
+        _upsert(cursor, table, "oi.order_id = ?", (order_id,), -1, archived)
+
+
+def rebuild(cursor):
+    """
+    Recalcula todos os agregados a partir dos pedidos existentes, vivos e
+    arquivados (o chamador faz o commit).
+    """
+    for table in _ITEMS_SELECT:
+        cursor.execute(f"DELETE FROM {table}")
+        for archived in _SOURCES:
+            _upsert(cursor, table, "o.status != 'rejected'", (), 1, archived)
+
+
+def analysis(cursor, date_from=None, date_to=None):
+    """
+    Totais por item e por hora do dia. Sem período, lê o total geral;
+    com período (datas AAAA-MM-DD, inclusivas), soma só os dias pedidos.
+    """
+    if date_from is None and date_to is None:
+        # O nome vem do estoque (o atual); sem o item no estoque, o último nome vendido
+        cursor.execute('''
+            SELECT COALESCE(s.name, t.name), t.quantity, t.revenue
+            FROM sales_item_totals t LEFT JOIN stock s ON s.id = t.stock_id
+            WHERE t.quantity > 0
+        ''')
+        items = cursor.fetchall()
+        cursor.execute('''
+            SELECT hour, SUM(quantity), SUM(revenue) FROM sales_hourly
+            GROUP BY hour HAVING SUM(quantity) > 0 ORDER BY hour
+        ''')
+        hours = cursor.fetchall()
+    else:
+        params = (date_from or '0000-00-00', date_to or '9999-99-99')
+        cursor.execute('''
+            SELECT COALESCE(s.name, MAX(d.name)), SUM(d.quantity), SUM(d.revenue)
+            FROM sales_daily d LEFT JOIN stock s ON s.id = d.stock_id
+            WHERE d.day BETWEEN ? AND ?
+            GROUP BY d.item_key HAVING SUM(d.quantity) > 0
+        ''', params)
+        items = cursor.fetchall()
+        cursor.execute('''
+            SELECT hour, SUM(quantity), SUM(revenue) FROM sales_hourly
+            WHERE day BETWEEN ? AND ?
+            GROUP BY hour HAVING SUM(quantity) > 0 ORDER BY hour
+        ''', params)
+        hours = cursor.fetchall()
+
+    sales_data = [{"name": name, "quantity": int(quantity), "revenue": round(revenue, 2)}
+                  for name, quantity, revenue in items]
+    sales_by_hour = [{"hour": hour, "quantity": int(quantity), "revenue": round(revenue, 2)}
+                     for hour, quantity, revenue in hours]
+    return sales_data, sales_by_hour
+
+
+def analysis_report(cursor, date_from=None, date_to=None):
+    """Corpo de /api/admin/sales/analysis (mais e menos vendido, totais por item e por hora)."""
+    sales_data, sales_by_hour = analysis(cursor, date_from, date_to)
+    if not sales_data:
+        return {"most_sold": None, "least_sold": None, "sales_data": [], "sales_by_hour": []}
+    most_sold_item = max(sales_data, key=lambda item: item["quantity"])
+    least_sold_item = min(sales_data, key=lambda item: item["quantity"])
+    return {
+        "most_sold": {"name": most_sold_item["name"], "quantity": most_sold_item["quantity"]},
+        "least_sold": {"name": least_sold_item["name"], "quantity": least_sold_item["quantity"]},
+        "sales_data": sales_data,
+        "sales_by_hour": sales_by_hour,
+    }
+
+
+# --- Filtros e paginação da lista de vendas ---
+
+def order_filters(date_from=None, date_to=None, statuses=None, payment_method=None, customer_prefix=None):
+    """
+    Monta as condições WHERE (lista) e os parâmetros dos filtros de pedidos.
+    date_from/date_to: dias AAAA-MM-DD (inclusivos, horário de Brasília),
+    filtrados como uma faixa de created_at_ms (busca pelo índice).
+    Lança ValueError se alguma data estiver em formato inválido.
+    """
+    where = []
+    params = []
+    start_ms, end_ms = timeutil.local_day_range_ms(date_from, date_to)
+    if start_ms is not None:
+        where.append("created_at_ms >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        where.append("created_at_ms < ?")
+        params.append(end_ms)
+    if statuses:
+        where.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if payment_method:
+        where.append("payment_method = ?")
+        params.append(payment_method)
+    if customer_prefix:
+        # Busca pelo início do nome, sem diferenciar maiúsculas. '%' e '_' digitados
+        # são procurados literalmente (escapados), não como curingas do LIKE
+        prefix = customer_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append("customer_name LIKE ? ESCAPE '\\'")
+        params.append(prefix + '%')
+    return where, params
+
+
+def encode_cursor(created_at_ms, order_id):
+    raw = f"{created_at_ms}|{order_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(token):
+    """Retorna (created_at_ms, id). Lança ValueError se o cursor for inválido."""
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        # Cursores antigos guardavam o created_at em texto (UTC)
+        created_at_ms = int(created_at) if created_at.isdigit() else timeutil.utc_text_to_ms(created_at)
+        return created_at_ms, int(order_id)
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {e}")
+
+
+def list_page(cursor, where, params, after=None, limit=50):
+    """
+    Uma página de vendas, da mais nova para a mais antiga, paginada por
+    (created_at_ms, id): cada página continua do ponto exato onde a anterior
+    parou, usando o índice em vez de pular linhas com OFFSET.
+    Cada tabela (viva e arquivo) devolve só as suas primeiras linhas pelo
+    índice, e o SQLite junta as duas listas curtas.
+    Retorna (linhas, próximo cursor ou None).
+    """
+    where = list(where)
+    params = list(params)
+    if after:
+        where.append("(created_at_ms, id) < (?, ?)")
+        params.extend(decode_cursor(after))
+
+    # created_at_ms (última coluna) só serve para o cursor; não vai na resposta
+    columns = ("id, customer_name, item_names, quantities, total, order_number, created_at, status, payment_method, "
+               "created_at_ms")
+    where_sql = " WHERE " + " AND ".join(where) if where else ""
+    legs = [f"SELECT * FROM (SELECT {columns} FROM {table}{where_sql} ORDER BY created_at_ms DESC, id DESC LIMIT ?)"
+            for table in ("orders", "orders_archive")]
+    sql = " UNION ALL ".join(legs) + " ORDER BY created_at_ms DESC, id DESC LIMIT ?"
+    cursor.execute(sql, (*params, limit + 1, *params, limit + 1, limit + 1))
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[-1], last[0])
+    return [row[:-1] for row in rows], next_cursor
+
+
+def summary(cursor, where, params):
+    """Totais (quantidade de pedidos e faturamento) do filtro inteiro, calculados no SQLite."""
+    sql = "SELECT status, COUNT(*), COALESCE(SUM(total), 0) FROM orders_all"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY status"
+    cursor.execute(sql, params)
+
+    by_status = {}
+    count = 0
+    revenue = 0.0
+    for status, status_count, status_total in cursor.fetchall():
+        by_status[status] = {"count": status_count, "total": round(status_total, 2)}
+        count += status_count
+        # Pedidos recusados não entram no faturamento
+        if status != 'rejected':
+            revenue += status_total
+    return {"count": count, "revenue": round(revenue, 2), "by_status": by_status}
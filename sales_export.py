@@ -0,0 +1,121 @@
+# sales_export.py
+# Exportação das vendas em CSV ou XLSX sem carregar a tabela inteira na memória.
+#
+# As linhas são lidas do SQLite em blocos (fetchmany) e escritas aos poucos:
+#   - CSV: um gerador que o Flask envia ao cliente enquanto lê o banco;
+#   - XLSX: workbook "write-only" do openpyxl, que grava cada linha direto em
+#     um arquivo temporário em vez de montar a planilha inteira na memória.
+# O uso de memória fica limitado ao tamanho do bloco, não ao número de pedidos.
+
+import csv
+import io
+import tempfile
+
+from openpyxl import Workbook
+
+import db
+import sales
+import timeutil
+
+# Quantidade de linhas lidas do banco por vez
+CHUNK_SIZE = 1000
+
+COLUMNS = ['ID', 'Senha', 'Cliente', 'Itens', 'Quantidades', 'Total (R$)', 'Pagamento', 'Status', 'Data/Hora']
+
+
+def build_query(date_from=None, date_to=None, statuses=None):
+    """
+    Monta o SELECT da exportação com os filtros opcionais (pedidos vivos e arquivados).
+    date_from/date_to: dias AAAA-MM-DD (inclusivos). statuses: lista de status.
+    Lança ValueError se alguma data estiver em formato inválido.
+    """
+    where, params = sales.order_filters(date_from, date_to, statuses)
+
+    sql = f'''
+        SELECT id, order_number, customer_name, item_names, quantities, total, payment_method, status,
+               {timeutil.local_datetime_sql('created_at_ms', '%d/%m/%Y %H:%M:%S')}
+        FROM orders_all
+    '''
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at_ms DESC"
+    return sql, params
+
+
+def iter_rows(sql, params, chunk_size=CHUNK_SIZE, source=db, conn=None):
+    """
+    Gera as linhas da consulta em blocos.
+    source: módulo com get_connection/release_connection (db ou reporting);
+    conn: conexão já retirada de source (ex: para saber a data dos dados antes).
+    Quem passa conn continua responsável por devolvê-la; sem conn, a conexão
+    é retirada e devolvida aqui.
+    """
+    own = conn is None
+    if own:
+        conn = source.get_connection()
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        if own:
+            source.release_connection(conn)
+
+
+def stream_csv(sql, params, source=db, conn=None):
+    """
+    Gerador do arquivo CSV, bloco a bloco. Usa ';' e BOM UTF-8 para o
+    Excel em português abrir os acentos e as colunas corretamente.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(COLUMNS)
+    yield '\ufeff' + buffer.getvalue()
+
+    for rows in iter_rows(sql, params, source=source, conn=conn):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def count_rows(sql, params, conn):
+    """Quantidade de linhas que a exportação vai gerar (para mostrar o progresso)."""
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+
+def write_csv(sql, params, path, on_rows=None, source=db, conn=None):
+    """Grava o CSV em path. on_rows(n) é chamado a cada bloco escrito."""
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        for number, chunk in enumerate(stream_csv(sql, params, source, conn)):
+            output.write(chunk)
+            # O primeiro bloco é só o cabeçalho
+            if on_rows and number:
+                on_rows(chunk.count('\n'))
+
+
+def write_xlsx(sql, params, output=None, on_rows=None, source=db, conn=None):
+    """
+    Escreve a planilha em output (caminho ou arquivo). Sem output, usa um
+    arquivo temporário (apagado automaticamente ao ser fechado) e o devolve
+    posicionado no início, pronto para o send_file.
+    on_rows(n) é chamado a cada bloco lido do banco.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Vendas')
+    sheet.append(COLUMNS)
+    for rows in iter_rows(sql, params, source=source, conn=conn):
+        for row in rows:
+            sheet.append(row)
+        if on_rows:
+            on_rows(len(rows))
+
+    if output is None:
+        output = tempfile.TemporaryFile()
+    workbook.save(output)
+    if hasattr(output, 'seek'):
+        output.seek(0)
+    return output
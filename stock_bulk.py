@@ -0,0 +1,262 @@
+# stock_bulk.py
+# Alteração do estoque em lote (/api/admin/stock/bulk).
+#
+# A entrega da manhã mexe em dezenas de itens; em vez de uma requisição (e um
+# commit) por item, o admin envia uma lista JSON ou uma planilha CSV/XLSX.
+#   1. As linhas são validadas de uma vez com pandas (tipos, faixas, ids).
+#   2. Cada linha é comparada com o item atual da tabela stock (diff).
+#   3. Sem dry_run, as alterações são gravadas com executemany em UMA transação.
+# A resposta traz o resultado de cada linha (o que mudou ou por que falhou).
+#
+# Colunas aceitas (os nomes em português da exportação também valem):
+#   id, name, price, quantity (valor final), add_quantity (soma ao atual),
+#   is_available, is_promo, detailed_description.
+# Linha sem id (e cujo nome não existe no estoque) cria um item novo.
+
+import io
+
+import pandas as pd
+
+# Máximo de linhas por envio
+MAX_ROWS = 5000
+
+COLUMNS = ('id', 'name', 'price', 'quantity', 'add_quantity', 'is_available', 'is_promo', 'detailed_description')
+
+ALIASES = {
+    'nome': 'name',
+    'item': 'name',
+    'preco': 'price',
+    'preço': 'price',
+    'quantidade': 'quantity',
+    'estoque': 'quantity',
+    'adicionar': 'add_quantity',
+    'repor': 'add_quantity',
+    'disponivel': 'is_available',
+    'disponível': 'is_available',
+    'brinde': 'is_promo',
+    'promo': 'is_promo',
+    'descricao': 'detailed_description',
+    'descrição': 'detailed_description',
+}
+
+_TRUE = {'1', 'true', 'sim', 'yes', 's', 'y'}
+_FALSE = {'0', 'false', 'nao', 'não', 'no', 'n'}
+
+# Campos comparados no diff (na ordem da resposta)
+_DIFF_FIELDS = ('name', 'price', 'quantity', 'is_available', 'is_promo', 'detailed_description')
+
+
+class BulkInputError(Exception):
+    """O envio inteiro é inválido (formato de arquivo, colunas, tamanho)."""
+
+
+def read_json(payload):
+    """Lista de dicts (ou {"items": [...]}) -> DataFrame."""
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise BulkInputError("Envie uma lista de itens (ou {\"items\": [...]}).")
+    return _normalize(pd.DataFrame(items, dtype=object))
+
+
+def read_upload(file_storage):
+    """Planilha enviada (CSV com ';' ou ',', ou XLSX) -> DataFrame."""
+    filename = (file_storage.filename or '').lower()
+    data = file_storage.read()
+    try:
+        if filename.endswith('.xlsx'):
+            frame = pd.read_excel(io.BytesIO(data), dtype=object)
+        elif filename.endswith('.csv'):
+            # sep=None descobre o separador (o Excel em português usa ';')
+            frame = pd.read_csv(io.BytesIO(data), sep=None, engine='python', dtype=object,
+                                encoding='utf-8-sig', keep_default_na=False, na_values=[''])
+        else:
+            raise BulkInputError("Formato de arquivo inválido. Use .csv ou .xlsx.")
+    except BulkInputError:
+        raise
+    except Exception as e:
+        raise BulkInputError(f"Não foi possível ler a planilha: {e}")
+    return _normalize(frame)
+
+
+def _normalize(frame):
+    if len(frame) > MAX_ROWS:
+        raise BulkInputError(f"Máximo de {MAX_ROWS} linhas por envio.")
+    frame = frame.rename(columns=lambda c: ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    unknown = [c for c in frame.columns if c not in COLUMNS]
+    if unknown:
+        raise BulkInputError(f"Colunas desconhecidas: {', '.join(unknown)}. Aceitas: {', '.join(COLUMNS)}.")
+    if frame.columns.duplicated().any():
+        raise BulkInputError("Colunas repetidas na planilha.")
+    for column in COLUMNS:
+        if column not in frame.columns:
+            frame[column] = None
+    # Textos vazios contam como "não informado"
+    frame = frame[list(COLUMNS)].reset_index(drop=True).replace(r'^\s*$', None, regex=True)
+    # Linhas totalmente vazias (ex: ';;' que o Excel deixa no fim) são ignoradas.
+    # O índice é mantido, então o número da linha no resultado continua o da planilha.
+    return frame.dropna(how='all')
+
+
+def _add_error(errors, mask, message):
+    for index in mask[mask].index:
+        errors[index].append(message)
+
+
+def _numeric(frame, column, errors, integer=False):
+    raw = frame[column]
+    values = pd.to_numeric(raw.astype(str).str.replace(',', '.', regex=False).where(raw.notna()), errors='coerce')
+    _add_error(errors, raw.notna() & values.isna(), f"'{column}' não é um número.")
+    if integer:
+        _add_error(errors, values.notna() & (values % 1 != 0), f"'{column}' deve ser um número inteiro.")
+    return values
+
+
+def _boolean(frame, column, errors):
+    raw = frame[column].map(lambda v: str(v).strip().lower() if v is not None and not pd.isna(v) else None)
+    values = raw.map(lambda v: 1 if v in _TRUE else 0 if v in _FALSE else None)
+    _add_error(errors, raw.notna() & values.isna(), f"'{column}' deve ser sim/não (1/0).")
+    return values
+
+
+def _value(value):
+    """Converte valores do pandas (NaN, numpy) para tipos do Python/SQLite."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def plan(cursor, frame):
+    """
+    Valida as linhas e calcula o diff com o estoque atual.
+    Retorna (resultados por linha, linhas de UPDATE, linhas de INSERT).
+    """
+    errors = {index: [] for index in frame.index}
+
+    ids = _numeric(frame, 'id', errors, integer=True)
+    price = _numeric(frame, 'price', errors)
+    quantity = _numeric(frame, 'quantity', errors, integer=True)
+    add_quantity = _numeric(frame, 'add_quantity', errors, integer=True)
+    is_available = _boolean(frame, 'is_available', errors)
+    is_promo = _boolean(frame, 'is_promo', errors)
+    names = frame['name'].map(lambda v: str(v).strip() if v is not None and not pd.isna(v) else None)
+    descriptions = frame['detailed_description'].map(lambda v: str(v) if v is not None and not pd.isna(v) else None)
+
+    _add_error(errors, price < 0, "'price' não pode ser negativo.")
+    _add_error(errors, quantity < 0, "'quantity' não pode ser negativa.")
+    _add_error(errors, quantity.notna() & add_quantity.notna(), "Use 'quantity' OU 'add_quantity', não os dois.")
+    _add_error(errors, ids.isna() & names.isna(), "Informe 'id' ou 'name'.")
+
+    # Estoque atual dos itens citados (por id e por nome)
+    cursor.execute("SELECT id, name, price, quantity, is_available, is_promo, detailed_description FROM stock")
+    current = {row[0]: dict(zip(('id',) + _DIFF_FIELDS, row)) for row in cursor.fetchall()}
+    by_name = {}
+    for item in current.values():
+        by_name.setdefault(item['name'], []).append(item['id'])
+
+    # Resolve o id de cada linha (pelo id informado ou pelo nome)
+    resolved = []
+    for index in frame.index:
+        item_id = ids[index]
+        if pd.notna(item_id):
+            item_id = int(item_id)
+            if item_id not in current:
+                errors[index].append(f"Item {item_id} não encontrado.")
+            resolved.append(item_id)
+            continue
+        name = _value(names[index])
+        matches = by_name.get(name, []) if name else []
+        if len(matches) > 1:
+            errors[index].append(f"Nome '{name}' aparece em mais de um item; informe o 'id'.")
+        resolved.append(matches[0] if len(matches) == 1 else None)
+    resolved = pd.Series(resolved, index=frame.index, dtype=object)
+    _add_error(errors, resolved.notna() & resolved.duplicated(keep=False), "Item repetido no envio.")
+
+    results = []
+    updates = []
+    inserts = []
+    for index in frame.index:
+        item_id = resolved[index]
+        row = {
+            'name': _value(names[index]),
+            'price': _value(price[index]),
+            'quantity': int(quantity[index]) if pd.notna(quantity[index]) else None,
+            'add_quantity': int(add_quantity[index]) if pd.notna(add_quantity[index]) else None,
+            'is_available': _value(is_available[index]),
+            'is_promo': _value(is_promo[index]),
+            'detailed_description': _value(descriptions[index]),
+        }
+        result = {"row": int(index) + 1, "id": item_id, "name": row['name']}
+
+        if item_id is None:
+            result["action"] = "create"
+            promo = row['is_promo'] == 1
+            required = ['name', 'detailed_description'] + ([] if promo else ['price'])
+            missing = [f for f in required if row[f] is None]
+            if row['quantity'] is None and row['add_quantity'] is None:
+                missing.append('quantity')
+            if missing:
+                errors[index].append(f"Item novo sem: {', '.join(missing)}.")
+            if row['add_quantity'] is not None and row['add_quantity'] < 0:
+                errors[index].append("'add_quantity' deixaria o estoque negativo.")
+            new_item = {
+                'name': row['name'],
+                'price': 0.0 if promo else row['price'],
+                'quantity': row['quantity'] if row['quantity'] is not None else row['add_quantity'],
+                'is_available': 1 if row['is_available'] is None else row['is_available'],
+                'is_promo': 1 if promo else 0,
+                'detailed_description': row['detailed_description'],
+            }
+            result["changes"] = {field: {"from": None, "to": new_item[field]} for field in _DIFF_FIELDS}
+            if not errors[index]:
+                inserts.append(new_item)
+        else:
+            item = current.get(item_id)
+            result["name"] = result["name"] or (item and item['name'])
+            result["changes"] = {}
+            if item is not None:
+                target = dict(item)
+                for field in ('name', 'price', 'is_available', 'is_promo', 'detailed_description'):
+                    if row[field] is not None:
+                        target[field] = row[field]
+                if row['quantity'] is not None:
+                    target['quantity'] = row['quantity']
+                elif row['add_quantity'] is not None:
+                    target['quantity'] = item['quantity'] + row['add_quantity']
+                    if target['quantity'] < 0:
+                        errors[index].append(
+                            f"'add_quantity' deixaria o estoque negativo (atual: {item['quantity']}).")
+                result["changes"] = {field: {"from": item[field], "to": target[field]}
+                                     for field in _DIFF_FIELDS if item[field] != target[field]}
+            result["action"] = "update" if result["changes"] or item is None else "unchanged"
+            if not errors[index] and result["changes"]:
+                updates.append((row['name'], row['price'], row['quantity'], row['add_quantity'] or 0,
+                                row['is_available'], row['is_promo'], row['detailed_description'], item_id))
+
+        result["errors"] = errors[index]
+        result["status"] = "error" if errors[index] else "ok"
+        results.append(result)
+    return results, updates, inserts
+
+
+def apply(cursor, updates, inserts):
+    """Grava as alterações (chamar dentro da transação). Retorna os ids criados."""
+    # A soma (add_quantity) é feita no próprio UPDATE, sobre o valor atual
+    cursor.executemany('''
+        UPDATE stock SET
+            name = COALESCE(?, name),
+            price = COALESCE(?, price),
+            quantity = COALESCE(?, quantity) + ?,
+            is_available = COALESCE(?, is_available),
+            is_promo = COALESCE(?, is_promo),
+            detailed_description = COALESCE(?, detailed_description)
+        WHERE id = ?
+    ''', updates)
+    created = []
+    for item in inserts:
+        cursor.execute('''
+            INSERT INTO stock (name, price, quantity, is_available, is_promo, detailed_description)
+            VALUES (:name, :price, :quantity, :is_available, :is_promo, :detailed_description)
+            RETURNING id
+        ''', item)
+        created.append(cursor.fetchone()[0])
+    return created
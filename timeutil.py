@@ -0,0 +1,85 @@
+# timeutil.py
+# Datas/horas dos pedidos e avaliações em milissegundos desde 1970 (UTC).
+#
+# As colunas de texto tinham formatos misturados: orders.created_at em UTC
+# (CURRENT_TIMESTAMP) e orders.called_at / scores.created_at no horário de
+# Brasília, gravados pelo Python. Filtros por período precisavam converter
+# cada linha e não usavam índice. As colunas *_ms (INTEGER, sempre UTC) são
+# gravadas junto com as de texto e indexadas:
+#   - filtros por dia viram faixas [início, fim) em ms -> busca pelo índice;
+#   - o fuso (Brasília) só entra na apresentação e no agrupamento por dia/hora.
+# As colunas de texto continuam sendo gravadas, para compatibilidade.
+
+import time
+from datetime import datetime, timedelta, timezone
+
+# Horário de Brasília (UTC-3), como o resto do app
+LOCAL_UTC_OFFSET = timedelta(hours=-3)
+LOCAL_TIME_MODIFIER = '-3 hours'   # UTC -> Brasília (modificador de data do SQLite)
+UTC_TIME_MODIFIER = '+3 hours'     # Brasília -> UTC
+
+DAY_MS = 86_400_000
+
+# Agora, em ms, calculado pelo SQLite. Dentro de um mesmo comando, 'now' é o
+# mesmo instante do CURRENT_TIMESTAMP (created_at e created_at_ms batem).
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(moment):
+    """datetime (com fuso, ou ingênuo em UTC) -> ms."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def local_now(ms=None):
+    """Data/hora de Brasília (ingênua) do instante em ms (padrão: agora)."""
+    ms = now_ms() if ms is None else ms
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).replace(tzinfo=None) + LOCAL_UTC_OFFSET
+
+
+def utc_text_to_ms(text):
+    """'2025-11-18 03:00:00' (UTC, formato do created_at) -> ms. Lança ValueError."""
+    return to_ms(datetime.fromisoformat(text))
+
+
+def local_day_start_ms(day):
+    """'2025-11-18' (dia em Brasília) -> ms da meia-noite desse dia. Lança ValueError."""
+    return to_ms(datetime.strptime(day, '%Y-%m-%d') - LOCAL_UTC_OFFSET)
+
+
+def local_day_range_ms(date_from=None, date_to=None):
+    """
+    Faixa [início, fim) em ms dos dias AAAA-MM-DD (inclusivos, horário de
+    Brasília). Um lado ausente vira None. Lança ValueError se a data for inválida.
+    """
+    start = local_day_start_ms(date_from) if date_from else None
+    end = local_day_start_ms(date_to) + DAY_MS if date_to else None
+    return start, end
+
+
+# --- Expressões SQL (agrupamento e apresentação no horário de Brasília) ---
+
+def local_day_sql(column):
+    """Dia (AAAA-MM-DD, Brasília) da coluna em ms."""
+    return f"date({column} / 1000, 'unixepoch', '{LOCAL_TIME_MODIFIER}')"
+
+
+def local_hour_sql(column):
+    """Hora do dia (0 a 23, Brasília) da coluna em ms."""
+    return f"CAST(strftime('%H', {column} / 1000, 'unixepoch', '{LOCAL_TIME_MODIFIER}') AS INTEGER)"
+
+
+def local_datetime_sql(column, fmt='%Y-%m-%d %H:%M:%S'):
+    """Data/hora formatada (Brasília) da coluna em ms."""
+    return f"strftime('{fmt}', {column} / 1000, 'unixepoch', '{LOCAL_TIME_MODIFIER}')"
+
+
+def utc_text_to_ms_sql(column, modifier=None):
+    """Converte uma coluna de texto para ms (modifier: ex. UTC_TIME_MODIFIER para textos em Brasília)."""
+    extra = f", '{modifier}'" if modifier else ""
+    return f"CAST(strftime('%s', {column}{extra}) AS INTEGER) * 1000"